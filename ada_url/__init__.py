@@ -1,35 +1,89 @@
 from ada_url.ada_adapter import (
     URL,
+    BaseURL,
+    Canonicalizer,
+    ComponentAggregator,
+    FailureType,
     HostType,
+    IDNACache,
+    InternTable,
+    LazyURL,
+    PublicSuffixList,
+    RobotsRules,
     SchemeType,
+    URLIndex,
     URLSearchParams,
+    URLStore,
+    URLTemplate,
+    URLView,
     get_version,
     check_url,
+    check_urls,
+    diagnose_urls,
+    extract_urls,
+    group_by_origin,
     idna,
     idna_to_ascii,
     idna_to_unicode,
     join_url,
     normalize_url,
+    open_index,
     parse_search_params,
     parse_url,
+    percent_decode,
+    percent_decode_many,
+    percent_encode,
+    percent_encode_many,
     replace_search_params,
     replace_url,
+    rewrite_links,
+    scope,
+    surt,
+    surt_many,
+    write_index,
 )
 
 __all__ = [
+    'BaseURL',
+    'Canonicalizer',
+    'ComponentAggregator',
+    'FailureType',
     'HostType',
+    'IDNACache',
+    'InternTable',
+    'LazyURL',
+    'PublicSuffixList',
+    'RobotsRules',
     'SchemeType',
     'URL',
+    'URLIndex',
     'URLSearchParams',
+    'URLStore',
+    'URLTemplate',
+    'URLView',
     'check_url',
+    'check_urls',
+    'diagnose_urls',
+    'extract_urls',
     'get_version',
+    'group_by_origin',
     'idna',
     'idna_to_ascii',
     'idna_to_unicode',
     'join_url',
     'normalize_url',
+    'open_index',
     'parse_search_params',
     'parse_url',
+    'percent_decode',
+    'percent_decode_many',
+    'percent_encode',
+    'percent_encode_many',
     'replace_search_params',
     'replace_url',
+    'rewrite_links',
+    'scope',
+    'surt',
+    'surt_many',
+    'write_index',
 ]
@@ -1,16 +1,37 @@
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
+from codecs import getincrementaldecoder
+from contextlib import contextmanager
 from copy import deepcopy
 from enum import IntEnum
+from fnmatch import translate
+from functools import lru_cache
+from html import unescape as html_unescape
+from html.entities import html5 as html5_entities
+from os.path import dirname, join
+from threading import Lock, local
 from typing import (
+    Any,
+    Callable,
     Dict,
     Final,
     Iterable,
     Iterator,
     List,
+    NamedTuple,
     Optional,
     Tuple,
     TypedDict,
     Union,
 )
+from unicodedata import normalize
+from urllib.parse import unquote_to_bytes
+from weakref import WeakSet
+from zlib import crc32
 
 from ada_url._ada_wrapper import ffi, lib
 
@@ -28,6 +49,9 @@ URL_ATTRIBUTES = (
 )
 PARSE_ATTRIBUTES = URL_ATTRIBUTES + ('origin', 'host_type', 'scheme_type')
 
+# These are the positions of the URL_ATTRIBUTES in the result of _get_spans
+_SPAN_INDEXES = {attr: i for i, attr in enumerate(URL_ATTRIBUTES)}
+
 # These are the attributes that have corresponding ada_get_* functions
 GET_ATTRIBUTES = frozenset(PARSE_ATTRIBUTES)
 
@@ -42,6 +66,174 @@ UNSET_ATTRIBUTES = frozenset(('username', 'password', 'pathname'))
 
 _marker = object()
 
+# This is ada_url_omitted from ada_c.h, which marks absent url_components
+URL_OMITTED = 0xFFFFFFFF
+
+PUBLIC_SUFFIX_LIST_PATH = join(dirname(__file__), 'public_suffix_list.dat')
+
+# Inputs that start with a scheme and "//" are parsed without using the base URL
+_ABSOLUTE_URL_RE = re.compile(rb'[A-Za-z][A-Za-z0-9+.\-]*://')
+
+# Matches a host label that is an IPv4 number
+_IPV4_NUMBER_RE = re.compile(r'(?:[0-9]+|0[xX][0-9A-Fa-f]*)\Z')
+
+SPECIAL_SCHEMES = frozenset(('ftp', 'file', 'http', 'https', 'ws', 'wss'))
+
+# These are used by diagnose_urls to categorize parsing failures
+_C0_CONTROL_OR_SPACE = ''.join(chr(i) for i in range(0x21))
+_SCHEME_RE = re.compile(r'([A-Za-z][A-Za-z0-9+.\-]*):')
+_AUTHORITY_END_RE = re.compile(r'[/?#]')
+_SPECIAL_AUTHORITY_END_RE = re.compile(r'[/\\?#]')
+_FORBIDDEN_HOST_RE = re.compile(r'[\x00\t\n\r #/:<>?@\[\\\]^|]')
+_FORBIDDEN_DOMAIN_RE = re.compile(r'[\x00-\x20#%/:<>?@\[\\\]^|\x7f]')
+
+# Percent-encode sets from https://url.spec.whatwg.org/#percent-encoded-bytes.
+# Each one also includes the C0 controls and all bytes above 0x7E.
+PERCENT_ENCODE_SETS = {
+    'c0_control': b'',
+    'fragment': b' "<>`',
+    'query': b' "#<>',
+    'special_query': b' "#\'<>',
+    'path': b' "#<>?^`{}',
+    'userinfo': b' "#/:;<=>?@[\\]^`{|}',
+    'component': b' "#$%&+,/:;<=>?@[\\]^`{|}',
+    'form_urlencoded': b' !"#$%&\'()+,/:;<=>?@[\\]^`{|}~',
+}
+
+_PERCENT_DECODE_RE = re.compile(rb'(?:%[0-9A-Fa-f]{2})+')
+
+# These are used by extract_urls. The pre-scan looks for "://", "www." and
+# "mailto:". Literal alternatives are much quicker to search for than a
+# case-insensitive pattern, so only the common spellings are listed.
+_URL_PRESCAN_PATTERN = r'://|www\.|WWW\.|Www\.|mailto:|MAILTO:|Mailto:'
+_URL_SCHEME_CHARS_PATTERN = r'[A-Za-z0-9+.\-]*'
+_URL_LETTER_PATTERN = r'[A-Za-z]'
+_URL_BODY_PATTERN = r'[^\s<>"\'`]*'
+_URL_WORD_CHAR_PATTERN = r'[A-Za-z0-9+.\-@]'
+_URL_SCANNER = tuple(
+    re.compile(p)
+    for p in (
+        _URL_PRESCAN_PATTERN,
+        _URL_SCHEME_CHARS_PATTERN,
+        _URL_LETTER_PATTERN,
+        _URL_BODY_PATTERN,
+        _URL_WORD_CHAR_PATTERN,
+    )
+)
+_URL_BYTES_SCANNER = tuple(re.compile(p.pattern.encode('ascii')) for p in _URL_SCANNER)
+_URL_MAX_SCHEME_LENGTH = 64
+_URL_TRAILING_PUNCTUATION = frozenset('?!.,:;*_~')
+_URL_CLOSING_BRACKETS = {')': '(', ']': '[', '}': '{'}
+
+# These are used by rewrite_links. The scanner matches comments (or just their
+# start, if they aren't closed), elements whose content isn't markup (with their
+# opening tag's attributes in group 2), and other tags (with their attributes in
+# group 4).
+LINK_ATTRIBUTES = ('href', 'src', 'action', 'srcset')
+_HTML_ATTRIBUTES_PATTERN = r'((?:[^>"\']|"[^"]*"|\'[^\']*\')*)'
+_HTML_SCANNER_RE = re.compile(
+    r'<!--(?:.*?-->)?'
+    r'|<(script|style|textarea|title|xmp)\b'
+    + _HTML_ATTRIBUTES_PATTERN
+    + r'>.*?</\1\s*>'
+    r'|<([A-Za-z][^\s/>]*)' + _HTML_ATTRIBUTES_PATTERN + r'>',
+    re.DOTALL | re.IGNORECASE,
+)
+_HTML_ATTRIBUTE_RE = re.compile(
+    r'([^\s"\'>/=]+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'=<>`]+)))?'
+)
+_HTML_RAW_TEXT_ELEMENTS = frozenset(('script', 'style', 'textarea', 'title', 'xmp'))
+_HTML_RAW_TEXT_END_RES = {
+    name: re.compile(rf'</{name}\s*>', re.IGNORECASE)
+    for name in _HTML_RAW_TEXT_ELEMENTS
+}
+_HTML_COMMENT_END_RE = re.compile('-->')
+_HTML_PARTIAL_END_RE = re.compile(r'(?:</?[A-Za-z]*\s*|--?)\Z')
+_HTML_CONSTRUCT_START_RE = re.compile(r'<[A-Za-z!/?]|<\Z')
+_HTML_WHITESPACE = ' \t\n\f\r'
+_HTML_CHARREF_RE = re.compile(r'&(?:#[0-9]+;?|#[xX][0-9A-Fa-f]+;?|([A-Za-z0-9]+)(;?))')
+_SRCSET_SEPARATOR_RE = re.compile(r'[\s,]*')
+_SRCSET_URL_RE = re.compile(r'\S+')
+_SRCSET_DESCRIPTORS_RE = re.compile(r'(?:[^,(]|\([^)]*\))*')
+_REWRITE_CHUNK_SIZE = 64 * 1024
+# Incomplete tags that are longer than this aren't held for the next piece
+_REWRITE_MAX_PENDING = 1024 * 1024
+
+# These are used by RobotsRules. Paths are compared after percent-encoding the
+# characters that are neither reserved nor unreserved, decoding the escapes for
+# unreserved characters, and upper-casing the rest (RFC 9309 section 2.2.2).
+_ROBOTS_PRODUCT_TOKEN_RE = re.compile(r'\s*([A-Za-z_-]+|\*)')
+_ROBOTS_UNRESERVED = frozenset(
+    b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~'
+)
+_ROBOTS_UNSAFE_RE = re.compile(rb"[^A-Za-z0-9\-._~:/?#\[\]@!$&'()*+,;=]")
+_ROBOTS_ESCAPE_RE = re.compile(
+    rb"%([0-9A-Fa-f]{2})|[^A-Za-z0-9\-._~:/?#\[\]@!$&'()*+,;=]"
+)
+
+# These are used by Canonicalizer
+TRACKING_PARAMETERS = (
+    'utm_*',
+    '_ga',
+    '_gl',
+    'dclid',
+    'fbclid',
+    'gclid',
+    'gclsrc',
+    'igshid',
+    'mc_cid',
+    'mc_eid',
+    'msclkid',
+    'yclid',
+)
+DEFAULT_CANONICALIZATION_PROFILE = {
+    'strip_params': TRACKING_PARAMETERS,
+    'sort_query': True,
+    'drop_fragment': True,
+    'index_files': (
+        'default.asp',
+        'default.aspx',
+        'default.htm',
+        'default.html',
+        'index.asp',
+        'index.aspx',
+        'index.htm',
+        'index.html',
+        'index.php',
+        'index.shtml',
+    ),
+    'lowercase_path_hosts': (),
+}
+
+# These are used by URLTemplate
+_TEMPLATE_FIELD_RE = re.compile(r'\{([A-Za-z_][A-Za-z0-9_]*)\}')
+_TEMPLATE_LITERAL = 0
+_TEMPLATE_FIELD = 1
+_TEMPLATE_HOST = 2
+_TEMPLATE_ENCODE_SETS = {
+    'username': 'userinfo',
+    'password': 'userinfo',
+    'hostname': None,
+    'pathname': 'path',
+    'search': 'component',
+    'hash': 'fragment',
+}
+_DOT_SEGMENT_RE = re.compile(r'(?:^|/)(?:\.|%2[eE]){1,2}(?:/|\Z)')
+
+# surt removes a leading "www" label, optionally followed by a number
+_WWW_LABEL_RE = re.compile(r'www[0-9]*\Z')
+
+# These describe the file format used by write_index and open_index. The
+# header is followed by sections that each start on an 8-byte boundary:
+# the hrefs, then the URLStore tables, then the optional hash table.
+_INDEX_MAGIC = b'ADAURLIX'
+_INDEX_VERSION = 1
+# magic, version, flags, URL count, hrefs offset, hrefs length, then the offsets
+# of the href starts, components, and flags, then the hash table offset and size
+_INDEX_HEADER = struct.Struct('<8sII8Q')
+_INDEX_WIDE_OFFSETS = 0b01
+_INDEX_BIG_ENDIAN = 0b10
+
 
 class HostType(IntEnum):
     """
@@ -93,6 +285,44 @@ class SchemeType(IntEnum):
     FILE = 6
 
 
+class FailureType(IntEnum):
+    """
+    Enum for the reasons that :func:`diagnose_urls` gives for invalid URLs.
+
+    * ``NONE`` is ``0``, and is used for valid URLs.
+    * ``OTHER`` is ``1``, and is used for failures that don't fit the other
+      categories.
+    * ``SCHEME`` is ``2``, and is used for URLs without a valid scheme, such as
+      relative references like ``/path``.
+    * ``HOST`` is ``3``, and is used for empty hosts and domains that fail
+      IDNA processing, like ``https://xn--/``.
+    * ``IPV4`` is ``4``, and is used for malformed IPv4 addresses, like
+      ``https://1.2.3.4.5/``.
+    * ``IPV6`` is ``5``, and is used for malformed IPv6 addresses, like
+      ``https://[::1/``.
+    * ``FORBIDDEN_CODE_POINT`` is ``6``, and is used for hosts with forbidden
+      characters, like ``https://exa<mple.org``.
+    * ``PORT`` is ``7``, and is used for ports that are not numbers between ``0``
+      and ``65535``.
+
+    .. code-block:: python
+
+        >>> from ada_url import FailureType
+        >>> FailureType.PORT
+        <FailureType.PORT: 7>
+
+    """
+
+    NONE = 0
+    OTHER = 1
+    SCHEME = 2
+    HOST = 3
+    IPV4 = 4
+    IPV6 = 5
+    FORBIDDEN_CODE_POINT = 6
+    PORT = 7
+
+
 class ParseAttributes(TypedDict, total=False):
     href: str
     username: str
@@ -115,11 +345,187 @@ def _get_obj(constructor, destructor, *args):
     return ffi.gc(obj, destructor)
 
 
+# Each thread has a stack of the scope() blocks it's in, with a list of the
+# objects that were created in each. The number of open blocks in all threads
+# is also kept, so that the thread-local state is only checked when needed.
+_scope_state = local()
+_scope_count = 0
+_scope_lock = Lock()
+
+
+def _add_to_scope(owner) -> bool:
+    # Inside a scope() block, adds an object with a close() method to the
+    # objects that are closed when it ends. Callers check _scope_count first.
+    stack = getattr(_scope_state, 'stack', None)
+    if stack:
+        stack[-1].append(owner)
+        owner.__dict__['_scoped'] = True
+        return True
+
+    return False
+
+
+def _get_handle(owner, obj, destructor):
+    # Like _get_obj, but for objects with a close() method. Inside a scope()
+    # block, no finalizer is registered: the owner is closed when the block ends.
+    if _scope_count and _add_to_scope(owner):
+        return obj
+
+    return ffi.gc(obj, destructor)
+
+
+def _release_handle(owner, obj, destructor):
+    # Frees an object that was returned by _get_handle
+    if owner.__dict__.get('_scoped'):
+        destructor(obj)
+    else:
+        ffi.release(obj)
+
+
+def _parse_with_optional_base(url_bytes: bytes, base_bytes: Optional[bytes]):
+    # Returns an unmanaged ada_url object, which the caller must free
+    if base_bytes is None:
+        return lib.ada_parse(url_bytes, len(url_bytes))
+
+    return lib.ada_parse_with_base(
+        url_bytes, len(url_bytes), base_bytes, len(base_bytes)
+    )
+
+
+def _invalid_url(default: Any, message: str = 'Invalid URL') -> Any:
+    # Returns the default value given to a function for invalid input, or raises
+    # ValueError if there wasn't one.
+    if default is _marker:
+        raise ValueError(message) from None
+
+    return default
+
+
+@contextmanager
+def scope() -> Iterator[None]:
+    """
+    Returns a context manager. The :class:`URL` and :class:`URLSearchParams`
+    objects (and their iterators) that are created inside the block are closed
+    when it ends.
+
+    .. code-block:: python
+
+        >>> import ada_url
+        >>> with ada_url.scope():
+        ...     hosts = [ada_url.URL(url).host for url in urls]
+
+    Objects created in the block don't have finalizers, so they are quicker to
+    create and their memory is released all at once, even if there are
+    reference cycles. Using them after the block ends raises ``ValueError``.
+
+    Blocks can be nested, and each thread has its own.
+    """
+    global _scope_count
+
+    stack = getattr(_scope_state, 'stack', None)
+    if stack is None:
+        stack = _scope_state.stack = []
+
+    owners = []
+    stack.append(owners)
+    with _scope_lock:
+        _scope_count += 1
+    try:
+        yield
+    finally:
+        with _scope_lock:
+            _scope_count -= 1
+        stack.pop()
+        for owner in reversed(owners):
+            owner.close()
+
+
 def _get_str(x):
     ret = ffi.string(x.data, x.length).decode() if x.length else ''
     return ret
 
 
+def _get_spans(href: bytes, components) -> Tuple[Tuple[int, int], ...]:
+    # Returns the (start, end) positions of each of the URL_ATTRIBUTES in href,
+    # given the ada_url_components for it. This mirrors the url_aggregator
+    # getters, so href[start:end] is equal to what ada_get_{attr} returns.
+    length = len(href)
+    protocol_end = components.protocol_end
+    username_end = components.username_end
+    host_start = components.host_start
+    host_end = components.host_end
+    pathname_start = components.pathname_start
+    search_start = components.search_start
+    hash_start = components.hash_start
+
+    if protocol_end + 2 < username_end:
+        username = (protocol_end + 2, username_end)
+    else:
+        username = (0, 0)
+
+    if host_start > username_end:
+        password = (username_end + 1, host_start)
+    else:
+        password = (0, 0)
+
+    if components.port == URL_OMITTED:
+        port = (0, 0)
+    else:
+        port = (host_end + 1, pathname_start)
+
+    hostname_start = host_start
+    if (host_end > host_start) and (href[host_start] == 0x40):  # '@'
+        hostname_start += 1
+    hostname = (hostname_start, host_end)
+    host = (0, 0) if hostname_start == host_end else (hostname_start, pathname_start)
+
+    if search_start != URL_OMITTED:
+        pathname_end = search_start
+    elif hash_start != URL_OMITTED:
+        pathname_end = hash_start
+    else:
+        pathname_end = length
+    pathname = (pathname_start, pathname_end)
+
+    search = (0, 0)
+    if search_start != URL_OMITTED:
+        search_end = length if hash_start == URL_OMITTED else hash_start
+        if search_end - search_start > 1:
+            search = (search_start, search_end)
+
+    hash = (0, 0)
+    if (hash_start != URL_OMITTED) and (length - hash_start > 1):
+        hash = (hash_start, length)
+
+    # This is the same order as URL_ATTRIBUTES
+    return (
+        (0, length),
+        username,
+        password,
+        (0, protocol_end),
+        port,
+        hostname,
+        host,
+        pathname,
+        search,
+        hash,
+    )
+
+
+# These are used by URL's setters, which are often called in bulk
+_SET_FUNCS = {attr: getattr(lib, f'ada_set_{attr}') for attr in SET_ATTRIBUTES}
+_CLEAR_FUNCS = {attr: getattr(lib, f'ada_clear_{attr}') for attr in CLEAR_ATTRIBUTES}
+
+# These have tuple origins; other schemes have opaque origins, except that
+# blob: URLs can take the origin of the URL in their path.
+_TUPLE_ORIGIN_SCHEME_TYPES = frozenset(
+    (SchemeType.HTTP, SchemeType.HTTPS, SchemeType.WS, SchemeType.WSS, SchemeType.FTP)
+)
+_ORIGIN_KEY_PREFIXES = {
+    scheme_type: bytes((scheme_type,)) for scheme_type in SchemeType
+}
+
+
 class URL:
     """
     Parses a *url* (with an optional *base*) according to the
@@ -155,6 +561,17 @@ class URL:
     * ``origin``, which will be a ``str``
     * ``host_type``, which will be a :class:`HostType` enum
     * ``scheme_type``, which will be a :class:`SchemeType` enum
+    * ``public_suffix`` and ``registrable_domain``, which are looked up in the
+      bundled :class:`PublicSuffixList` (``None`` for IP addresses)
+    * ``search_params``, which is a :class:`URLSearchParams` object bound to the
+      URL's query
+
+    .. code-block:: python
+
+        >>> urlobj = URL('https://example.org/?utm_source=x&q=1')
+        >>> urlobj.search_params.delete('utm_source')
+        >>> urlobj.href
+        'https://example.org/?q=1'
 
     The class also exposes a static method that checks whether the input
     *url* (and optional *base*) can be parsed:
@@ -166,6 +583,27 @@ class URL:
         >>> URL.can_parse(url, base)
         True
 
+    ``URL.parse()`` takes the same arguments, and returns a new URL object or
+    ``None`` (rather than raising ``ValueError``) if they can't be parsed:
+
+    .. code-block:: python
+
+        >>> URL.parse(url, base).href
+        'https://example.org/file_2.txt'
+        >>> URL.parse('bogus') is None
+        True
+
+    The URL's native memory is freed when it's garbage collected. It can be
+    freed earlier with the ``close()`` method, or by using the URL as a context
+    manager. Using it after that raises ``ValueError``. Shallow copies share
+    the memory, so they are closed together. See also :func:`scope`.
+
+    .. code-block:: python
+
+        >>> with URL('https://example.org/') as urlobj:
+        ...     urlobj.host
+        'example.org'
+
     See the `WHATWG docs <https://url.spec.whatwg.org/#url-class>`__ for
     more details on the URL class.
 
@@ -185,49 +623,80 @@ class URL:
     host_type: Final[HostType]
     scheme_type: Final[SchemeType]
 
+    # Created on first access to search_params
+    _search_params: Optional['URLSearchParams'] = None
+
     def __init__(self, url: str, base: Optional[str] = None):
         url_bytes = url.encode()
+        base_bytes = None if base is None else base.encode()
 
-        if base is None:
-            self.urlobj = _get_obj(
-                lib.ada_parse, lib.ada_free, url_bytes, len(url_bytes)
-            )
-        else:
-            base_bytes = base.encode()
-            self.urlobj = _get_obj(
-                lib.ada_parse_with_base,
-                lib.ada_free,
-                url_bytes,
-                len(url_bytes),
-                base_bytes,
-                len(base_bytes),
-            )
-
-        if not lib.ada_is_valid(self.urlobj):
+        urlobj = _parse_with_optional_base(url_bytes, base_bytes)
+        if not lib.ada_is_valid(urlobj):
+            lib.ada_free(urlobj)
             raise ValueError('Invalid input')
 
+        # Skips __setattr__, which is slow
+        self.__dict__['urlobj'] = _get_handle(self, urlobj, lib.ada_free)
+
+    @classmethod
+    def parse(cls, url: str, base: Optional[str] = None) -> Optional['URL']:
+        """
+        Returns a new URL object for *url* (with an optional *base*), or ``None``
+        if it can't be parsed. This is quicker than catching ``ValueError``
+        for input that is often invalid.
+        """
+        try:
+            url_bytes = url.encode()
+            base_bytes = None if base is None else base.encode()
+        except Exception:
+            return None
+
+        urlobj = _parse_with_optional_base(url_bytes, base_bytes)
+        if not lib.ada_is_valid(urlobj):
+            lib.ada_free(urlobj)
+            return None
+
+        ret = cls.__new__(cls)
+        ret.__dict__['urlobj'] = _get_handle(ret, urlobj, lib.ada_free)
+        return ret
+
     def __copy__(self):
+        # Shallow copies share the ada_url object, so they're tracked in order
+        # to close them together.
+        copies = self.__dict__.get('_copies')
+        if copies is None:
+            copies = self.__dict__['_copies'] = WeakSet([self])
+
         cls = self.__class__
         ret = cls.__new__(cls)
         ret.__dict__.update(self.__dict__)
         super(URL, ret).__init__()
+        copies.add(ret)
         return ret
 
     def __deepcopy__(self, memo):
+        if (self._search_params is not None) and self._search_params._dirty:
+            self._write_search_params()
+
         cls = self.__class__
         ret = cls.__new__(cls)
         super(URL, ret).__init__()
-        ret.urlobj = lib.ada_copy(self.urlobj)
+        ret.__dict__['urlobj'] = _get_handle(
+            ret, lib.ada_copy(self.urlobj), lib.ada_free
+        )
 
         return ret
 
     def __delattr__(self, attr: str):
+        if (self._search_params is not None) and self._search_params._dirty:
+            self._write_search_params()
+
         if attr in CLEAR_ATTRIBUTES:
-            clear_func = getattr(lib, f'ada_clear_{attr}')
-            clear_func(self.urlobj)
+            _CLEAR_FUNCS[attr](self.urlobj)
+            if (attr == 'search') and (self._search_params is not None):
+                self._search_params._stale = True
         elif attr in UNSET_ATTRIBUTES:
-            set_func = getattr(lib, f'ada_set_{attr}')
-            set_func(self.urlobj, b'', 0)
+            _SET_FUNCS[attr](self.urlobj, b'', 0)
         else:
             raise AttributeError(f'cannot remove {attr}')
 
@@ -236,6 +705,9 @@ class URL:
 
     def __getattr__(self, attr: str) -> Union[str, HostType, SchemeType]:
         if attr in GET_ATTRIBUTES:
+            if (self._search_params is not None) and self._search_params._dirty:
+                self._write_search_params()
+
             get_func = getattr(lib, f'ada_get_{attr}')
             data = get_func(self.urlobj)
             if attr == 'origin':
@@ -250,27 +722,219 @@ class URL:
 
             return ret
 
+        if attr == 'urlobj':
+            raise ValueError('URL is closed')
+
         raise AttributeError(f'no attribute named {attr}')
 
     def __setattr__(self, attr: str, value: str) -> None:
-        if attr in SET_ATTRIBUTES:
-            try:
-                value_bytes = value.encode()
-            except Exception:
-                raise ValueError(f'Invalid value for {attr}') from None
+        set_func = _SET_FUNCS.get(attr)
+        if set_func is None:
+            return super().__setattr__(attr, value)
 
-            set_func = getattr(lib, f'ada_set_{attr}')
-            ret = set_func(self.urlobj, value_bytes, len(value_bytes))
-            if (ret is not None) and (not ret):
-                raise ValueError(f'Invalid value for {attr}') from None
+        try:
+            value_bytes = value.encode()
+        except Exception:
+            raise ValueError(f'Invalid value for {attr}') from None
 
-            return ret
+        params = self._search_params
+        if (params is not None) and params._dirty:
+            self._write_search_params()
+
+        ret = set_func(self.urlobj, value_bytes, len(value_bytes))
+        if (ret is not None) and (not ret):
+            raise ValueError(f'Invalid value for {attr}') from None
+
+        if (params is not None) and (attr in ('href', 'search')):
+            params._stale = True
 
-        return super().__setattr__(attr, value)
+        return ret
 
     def __str__(self):
         return self.href
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Frees the URL's native memory. Calling this more than once has no effect.
+        """
+        params = self._search_params
+        if params is not None:
+            params._urlobj = None
+            params.close()
+
+        urlobj = self.__dict__.get('urlobj')
+        if urlobj is None:
+            return
+
+        for duplicate in self.__dict__.get('_copies', (self,)):
+            duplicate.__dict__.pop('urlobj', None)
+        _release_handle(self, urlobj, lib.ada_free)
+
+    def update(self, **components: str) -> None:
+        """
+        Sets several of the URL's components at once.
+
+        .. code-block:: python
+
+            >>> urlobj = URL('https://example.org/a?b#c')
+            >>> urlobj.update(protocol='http:', host='example.com', hash='')
+            >>> urlobj.href
+            'http://example.com/a?b'
+
+        The components are set in the same order as with :func:`replace_url`,
+        and an empty string unsets one. If any of the values is invalid,
+        ``ValueError`` is raised and the URL is left as it was.
+        """
+        if not SET_ATTRIBUTES.issuperset(components):
+            for attr in components:
+                if attr not in SET_ATTRIBUTES:
+                    raise ValueError(f'Unknown attribute: {attr}')
+
+        params = self._search_params
+        if (params is not None) and params._dirty:
+            self._write_search_params()
+
+        # If a value is invalid, the URL is restored from its original href
+        # (which parses to the same URL). A single failed setter doesn't change
+        # the URL, so nothing needs to be restored for one component.
+        urlobj = self.urlobj
+        original = None
+        if len(components) > 1:
+            href = lib.ada_get_href(urlobj)
+            original = ffi.unpack(href.data, href.length)
+
+        try:
+            for attr in URL_ATTRIBUTES:
+                value = components.get(attr, _marker)
+                if value is _marker:
+                    continue
+
+                try:
+                    value_bytes = value.encode()
+                except Exception:
+                    raise ValueError(f'Invalid value for {attr}') from None
+
+                if (not value_bytes) and (attr in CLEAR_ATTRIBUTES):
+                    _CLEAR_FUNCS[attr](urlobj)
+                    continue
+
+                ret = _SET_FUNCS[attr](urlobj, value_bytes, len(value_bytes))
+                if (ret is not None) and (not ret):
+                    raise ValueError(f'Invalid value for {attr}')
+        except BaseException:
+            if original is not None:
+                lib.ada_set_href(urlobj, original, len(original))
+            raise
+        finally:
+            if (params is not None) and (
+                ('href' in components) or ('search' in components)
+            ):
+                params._stale = True
+
+    @property
+    def search_params(self) -> 'URLSearchParams':
+        """
+        A :class:`URLSearchParams` object that is bound to this URL's query.
+        Changes to it are written back to the URL, and changes to the URL's
+        ``search`` or ``href`` are reflected in it.
+        """
+        params = self._search_params
+        if (params is None) or ('paramsobj' not in params.__dict__):
+            urlobj = self.urlobj
+            params = URLSearchParams('')
+            params._urlobj = urlobj
+            params._stale = True
+            super().__setattr__('_search_params', params)
+
+        return params
+
+    def _write_search_params(self):
+        self._search_params._write()
+
+    @property
+    def public_suffix(self) -> Optional[str]:
+        if self.host_type != HostType.DEFAULT:
+            return None
+
+        return PublicSuffixList.default().public_suffix(self.hostname)
+
+    @property
+    def registrable_domain(self) -> Optional[str]:
+        if self.host_type != HostType.DEFAULT:
+            return None
+
+        return PublicSuffixList.default().registrable_domain(self.hostname)
+
+    def same_origin(self, other: Union['URL', str]) -> bool:
+        """
+        Returns ``True`` if this URL has the same origin as *other* (a URL object
+        or string). This is quicker than comparing the ``origin`` attributes.
+
+        As in the WHATWG spec, opaque origins (e.g. for ``file:`` and ``data:``
+        URLs) are never the same as any other origin.
+        """
+        if not isinstance(other, URL):
+            other = URL(other)
+
+        a = _get_origin_obj(self.urlobj)
+        b = _get_origin_obj(other.urlobj)
+        if (a is None) or (b is None):
+            return False
+
+        if lib.ada_get_scheme_type(a) != lib.ada_get_scheme_type(b):
+            return False
+
+        host_a = lib.ada_get_host(a)
+        host_b = lib.ada_get_host(b)
+        return ffi.unpack(host_a.data, host_a.length) == ffi.unpack(
+            host_b.data, host_b.length
+        )
+
+    def same_site(self, other: Union['URL', str]) -> bool:
+        """
+        Returns ``True`` if this URL is same site with *other* (a URL object or
+        string), i.e. they have the same scheme and either the same host or the
+        same registrable domain. Ports are ignored.
+
+        Registrable domains are looked up in the bundled
+        :class:`PublicSuffixList`. Opaque origins are never same site.
+        """
+        if not isinstance(other, URL):
+            other = URL(other)
+
+        a = _get_origin_obj(self.urlobj)
+        b = _get_origin_obj(other.urlobj)
+        if (a is None) or (b is None):
+            return False
+
+        if lib.ada_get_scheme_type(a) != lib.ada_get_scheme_type(b):
+            return False
+
+        hostname_a = lib.ada_get_hostname(a)
+        hostname_b = lib.ada_get_hostname(b)
+        hostname_a = ffi.unpack(hostname_a.data, hostname_a.length)
+        hostname_b = ffi.unpack(hostname_b.data, hostname_b.length)
+        if hostname_a == hostname_b:
+            return True
+
+        if (lib.ada_get_host_type(a) != HostType.DEFAULT) or (
+            lib.ada_get_host_type(b) != HostType.DEFAULT
+        ):
+            return False
+
+        psl = PublicSuffixList.default()
+        domain = psl.registrable_domain(hostname_a.decode())
+        if domain is None:
+            return False
+
+        return domain == psl.registrable_domain(hostname_b.decode())
+
     def __repr__(self):
         duplicate = deepcopy(self)
         duplicate.password = ''
@@ -296,6 +960,242 @@ class URL:
         )
 
 
+class LazyURL(URL):
+    """
+    A :class:`URL` that isn't parsed until it's used, for pipelines where most
+    URLs are passed through without being inspected.
+
+    .. code-block:: python
+
+        >>> from ada_url import LazyURL
+        >>> urlobj = LazyURL('https://example.org/a?b')
+        >>> str(urlobj)
+        'https://example.org/a?b'
+        >>> urlobj.hostname
+        'example.org'
+
+    Only the quick validity check from :meth:`URL.can_parse` is done when the
+    object is created, and ``ValueError`` is raised if it fails. Set *validate*
+    to ``False`` to skip that, in which case ``ValueError`` is raised when the
+    URL is first used instead.
+
+    Reading or writing a component, or calling one of :class:`URL`'s methods,
+    parses the URL and keeps the result. ``str()`` and ``href`` parse the input
+    without keeping the result, and return the input itself if it was already
+    normalized. Inside a :func:`scope` block, it belongs to the block it was
+    created in, even if it's parsed in another one.
+
+    Creating a ``LazyURL`` takes about half as long as creating a :class:`URL`,
+    and it uses no native memory until it's parsed. Parsing it later takes
+    about as long as creating a :class:`URL`, though, so this is quicker only
+    when most of the objects aren't inspected.
+    """
+
+    def __init__(self, url: str, base: Optional[str] = None, *, validate: bool = True):
+        if validate and (not URL.can_parse(url, base)):
+            raise ValueError('Invalid input')
+
+        # Skips __setattr__, which is slow
+        d = self.__dict__
+        d['_input'] = url
+        d['_base'] = base
+        # Like other objects, it belongs to the scope() block it's created in,
+        # not the one it's parsed in.
+        if _scope_count:
+            _add_to_scope(self)
+
+    def __getattr__(self, attr: str):
+        if '_input' in self.__dict__:
+            if attr == 'urlobj':
+                return self._parse()
+            if attr == 'href':
+                return str(self)
+
+        return URL.__getattr__(self, attr)
+
+    def __copy__(self):
+        # Shallow copies share the parsed URL, so it's needed now
+        self.urlobj
+        return super().__copy__()
+
+    def __deepcopy__(self, memo):
+        if '_input' not in self.__dict__:
+            return super().__deepcopy__(memo)
+
+        cls = self.__class__
+        ret = cls.__new__(cls)
+        d = ret.__dict__
+        d.update(self.__dict__)
+        d.pop('_scoped', None)
+        if _scope_count:
+            _add_to_scope(ret)
+
+        return ret
+
+    def __str__(self) -> str:
+        d = self.__dict__
+        if '_input' not in d:
+            return self.href
+
+        if not d.get('_normalized'):
+            self._normalize()
+
+        return d['_input']
+
+    def close(self):
+        d = self.__dict__
+        d.pop('_input', None)
+        d.pop('_base', None)
+        super().close()
+
+    def _normalize(self):
+        # Parses the input without keeping the result, and replaces it with the
+        # normalized href if it's different. Either way, the input can then be
+        # returned by str().
+        d = self.__dict__
+        urlobj = self._parse_input()
+        try:
+            href = lib.ada_get_href(urlobj)
+            href_bytes = ffi.unpack(href.data, href.length)
+        finally:
+            lib.ada_free(urlobj)
+
+        if href_bytes != d['_input'].encode():
+            d['_input'] = href_bytes.decode()
+        d['_base'] = None
+        d['_normalized'] = True
+
+    def _parse_input(self):
+        # Returns an unmanaged ada_url object for the input
+        d = self.__dict__
+        try:
+            url_bytes = d['_input'].encode()
+            base_bytes = None if d['_base'] is None else d['_base'].encode()
+        except Exception:
+            raise ValueError('Invalid input') from None
+
+        urlobj = _parse_with_optional_base(url_bytes, base_bytes)
+        if not lib.ada_is_valid(urlobj):
+            lib.ada_free(urlobj)
+            raise ValueError('Invalid input')
+
+        return urlobj
+
+    def _parse(self):
+        urlobj = self._parse_input()
+        d = self.__dict__
+        del d['_input'], d['_base']
+        d.pop('_normalized', None)
+        if not d.get('_scoped'):
+            urlobj = ffi.gc(urlobj, lib.ada_free)
+        d['urlobj'] = urlobj
+        return urlobj
+
+
+class BaseURL:
+    """
+    Parses a *base* URL once so that many relative references can be resolved
+    against it.
+
+    .. code-block:: python
+
+        >>> from ada_url import BaseURL
+        >>> base = BaseURL('http://a/b/c/d;p?q')
+        >>> base.join('../g')
+        'http://a/b/g'
+        >>> base.join_many(['g', '?y', 'https://example.org'])
+        ['http://a/b/c/g', 'http://a/b/c/d;p?y', 'https://example.org/']
+
+    ``ValueError`` is raised if *base* is not a valid URL, or if a relative
+    reference can't be resolved.
+
+    The base URL is validated and normalized when the object is created.
+    References that carry their own scheme and authority (e.g.
+    ``https://example.org/``) don't depend on the base, so they are parsed
+    without it.
+    """
+
+    def __init__(self, base: str):
+        try:
+            base_bytes = base.encode()
+        except Exception:
+            raise ValueError('Invalid URL') from None
+
+        urlobj = _get_obj(lib.ada_parse, lib.ada_free, base_bytes, len(base_bytes))
+        if not lib.ada_is_valid(urlobj):
+            raise ValueError('Invalid URL') from None
+
+        self.href = _get_str(lib.ada_get_href(urlobj))
+        # The normalized href is all ASCII, which is Ada's fastest parsing path
+        self._base_bytes = self.href.encode()
+
+    def __repr__(self):
+        return f'<BaseURL "{self.href}">'
+
+    def __str__(self):
+        return self.href
+
+    def join(self, s: str, *, default: Any = _marker) -> str:
+        """
+        Return the URL that results from resolving *s* against the base URL.
+
+        If *default* is given, it's returned instead of raising ``ValueError``
+        for invalid input.
+        """
+        try:
+            s_bytes = s.encode()
+        except Exception:
+            return _invalid_url(default)
+
+        ret = self._join(s_bytes)
+        if ret is None:
+            return _invalid_url(default)
+
+        return ret
+
+    def join_many(
+        self, relatives: Iterable[str], *, default: Any = _marker
+    ) -> List[str]:
+        """
+        Return a list with the result of resolving each item of *relatives*
+        against the base URL.
+
+        If *default* is given, it's used in place of invalid items instead of
+        raising ``ValueError``.
+        """
+        join = self._join
+        ret = []
+        for s in relatives:
+            try:
+                s_bytes = s.encode()
+            except Exception:
+                ret.append(_invalid_url(default))
+                continue
+
+            href = join(s_bytes)
+            ret.append(_invalid_url(default) if href is None else href)
+
+        return ret
+
+    def _join(self, s_bytes: bytes) -> Optional[str]:
+        # Returns None if the result isn't valid
+        if _ABSOLUTE_URL_RE.match(s_bytes):
+            urlobj = lib.ada_parse(s_bytes, len(s_bytes))
+        else:
+            base_bytes = self._base_bytes
+            urlobj = lib.ada_parse_with_base(
+                s_bytes, len(s_bytes), base_bytes, len(base_bytes)
+            )
+
+        try:
+            if not lib.ada_is_valid(urlobj):
+                return None
+
+            return _get_str(lib.ada_get_href(urlobj))
+        finally:
+            lib.ada_free(urlobj)
+
+
 class URLSearchParams:
     """
     Parses the given *params* string according to the WHATWG URL parsing standard.
@@ -344,28 +1244,137 @@ class URLSearchParams:
         >>> list(obj.items())
         [('key1', 'value1'), ('key2', 'value2'), ('key2', 'value3')]
 
+    Like :class:`URL` objects, ``URLSearchParams`` objects and their iterators
+    have a ``close()`` method and can be used as context managers.
+
+    Set *indexed* to ``True`` for objects with many parameters that are looked
+    up repeatedly. A mapping of keys to values is then kept alongside the
+    parameters, so ``get()``, ``get_all()``, and ``has()`` don't need to scan
+    through all of them. It's built on the first lookup, and updated by the
+    methods that change the parameters.
+
     See the `WHATWG docs <https://url.spec.whatwg.org/#interface-urlsearchparams>`__ for
     more details on the URLSearchParams class.
 
     """
 
-    def __init__(self, params: str):
+    # For objects returned by URL.search_params: the bound URL's ada_url object,
+    # whether there are changes to write back to it, and whether its query has
+    # changed since it was last read.
+    _urlobj = None
+    _dirty = False
+    _stale = False
+
+    # For indexed objects: maps each key to its values, in order. It's built
+    # when it's first needed. Keys and values are kept as bytes, and values are
+    # decoded when they're read, as they are without the index.
+    _indexed = False
+    _index = None
+
+    def __init__(self, params: str, indexed: bool = False):
         params_bytes = params.encode()
-        self.paramsobj = _get_obj(
-            lib.ada_parse_search_params,
+        self.paramsobj = _get_handle(
+            self,
+            lib.ada_parse_search_params(params_bytes, len(params_bytes)),
             lib.ada_free_search_params,
-            params_bytes,
-            len(params_bytes),
         )
+        if indexed:
+            self._indexed = True
+
+    def __getattr__(self, attr: str):
+        if attr == 'paramsobj':
+            raise ValueError('URLSearchParams is closed')
+
+        raise AttributeError(f'no attribute named {attr}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Frees the object's native memory. Pending changes are written to the
+        bound URL first, if there is one. Calling this more than once has no
+        effect.
+        """
+        paramsobj = self.__dict__.get('paramsobj')
+        if paramsobj is None:
+            return
+
+        if self._dirty and (self._urlobj is not None):
+            self._write()
+        self._urlobj = None
+        self._stale = False
+        self._index = None
+        del self.paramsobj
+        _release_handle(self, paramsobj, lib.ada_free_search_params)
+
+    def _write(self):
+        # Copies the serialized params into the bound URL's query, without
+        # converting them to a Python string.
+        self._dirty = False
+        result = lib.ada_search_params_to_string(self.paramsobj)
+        try:
+            if result.length:
+                lib.ada_set_search(self._urlobj, result.data, result.length)
+            else:
+                lib.ada_clear_search(self._urlobj)
+        finally:
+            lib.ada_free_owned_string(result)
+
+    def _refresh(self):
+        self._stale = False
+        self._index = None
+        search = lib.ada_get_search(self._urlobj)
+        if search.length:
+            # Skip the leading '?'
+            lib.ada_search_params_reset(
+                self.paramsobj, search.data + 1, search.length - 1
+            )
+        else:
+            lib.ada_search_params_reset(self.paramsobj, b'', 0)
+
+    def _get_index(self) -> Dict[bytes, List[bytes]]:
+        index = self._index
+        if index is not None:
+            return index
+
+        # Reading the serialized form is quicker than iterating over the items.
+        # It's ASCII, with "key=value" pairs that have any "&", "=", "+", and
+        # non-ASCII characters in them percent-encoded, and spaces as "+".
+        index = self._index = {}
+        serialized = str(self)
+        if not serialized:
+            return index
+
+        for pair in serialized.replace('+', ' ').split('&'):
+            key, _, value = pair.partition('=')
+            key = unquote_to_bytes(key) if ('%' in key) else key.encode()
+            value = unquote_to_bytes(value) if ('%' in value) else value.encode()
+            values = index.get(key)
+            if values is None:
+                index[key] = [value]
+            else:
+                values.append(value)
+
+        return index
 
     @property
     def size(self) -> int:
+        if self._stale:
+            self._refresh()
+
         return lib.ada_search_params_size(self.paramsobj)
 
     def __len__(self) -> int:
         return self.size
 
     def append(self, key: str, value: str):
+        if self._stale:
+            self._refresh()
+
         key_bytes = key.encode()
         value_bytes = value.encode()
         lib.ada_search_params_append(
@@ -375,8 +1384,20 @@ class URLSearchParams:
             value_bytes,
             len(value_bytes),
         )
+        self._dirty = True
+
+        index = self._index
+        if index is not None:
+            values = index.get(key_bytes)
+            if values is None:
+                index[key_bytes] = [value_bytes]
+            else:
+                values.append(value_bytes)
 
     def delete(self, key: str, value: Optional[str] = None):
+        if self._stale:
+            self._refresh()
+
         key_bytes = key.encode()
         if value is None:
             lib.ada_search_params_remove(self.paramsobj, key_bytes, len(key_bytes))
@@ -389,13 +1410,38 @@ class URLSearchParams:
                 value_bytes,
                 len(value_bytes),
             )
+        self._dirty = True
+
+        index = self._index
+        if (index is not None) and (key_bytes in index):
+            if value is None:
+                del index[key_bytes]
+            else:
+                values = [x for x in index[key_bytes] if x != value_bytes]
+                if values:
+                    index[key_bytes] = values
+                else:
+                    del index[key_bytes]
 
     def get(self, key: str) -> str:
+        if self._stale:
+            self._refresh()
+
+        if self._indexed:
+            values = self._get_index().get(key.encode())
+            return values[0].decode() if values else ''
+
         key_bytes = key.encode()
         item = lib.ada_search_params_get(self.paramsobj, key_bytes, len(key_bytes))
         return _get_str(item)
 
     def get_all(self, key: str) -> List[str]:
+        if self._stale:
+            self._refresh()
+
+        if self._indexed:
+            return [value.decode() for value in self._get_index().get(key.encode(), ())]
+
         key_bytes = key.encode()
         items = lib.ada_search_params_get_all(self.paramsobj, key_bytes, len(key_bytes))
         count = lib.ada_strings_size(items)
@@ -408,6 +1454,15 @@ class URLSearchParams:
         return ret
 
     def has(self, key: str, value: Optional[str] = None) -> bool:
+        if self._stale:
+            self._refresh()
+
+        if self._indexed:
+            values = self._get_index().get(key.encode())
+            if values is None:
+                return False
+            return True if value is None else (value.encode() in values)
+
         key_bytes = key.encode()
         if value is None:
             return lib.ada_search_params_has(self.paramsobj, key_bytes, len(key_bytes))
@@ -422,6 +1477,9 @@ class URLSearchParams:
             )
 
     def set(self, key: str, value: str):
+        if self._stale:
+            self._refresh()
+
         key_bytes = key.encode()
         value_bytes = value.encode()
         lib.ada_search_params_set(
@@ -431,50 +1489,101 @@ class URLSearchParams:
             value_bytes,
             len(value_bytes),
         )
+        self._dirty = True
+
+        if self._index is not None:
+            self._index[key_bytes] = [value_bytes]
 
     def sort(self):
+        if self._stale:
+            self._refresh()
+
+        # The sort is stable, so each key's values stay in the same order, and
+        # the index doesn't change.
         lib.ada_search_params_sort(self.paramsobj)
+        self._dirty = True
 
     def keys(self) -> Iterator[str]:
-        iterator = _get_obj(
-            lib.ada_search_params_get_keys,
-            lib.ada_free_search_params_keys_iter,
-            self.paramsobj,
-        )
-        while lib.ada_search_params_keys_iter_has_next(iterator):
-            item = lib.ada_search_params_keys_iter_next(iterator)
-            yield _get_str(item)
+        if self._stale:
+            self._refresh()
+
+        return _SearchParamsIterator(self, 'keys')
 
     def values(self) -> Iterator[str]:
-        iterator = _get_obj(
-            lib.ada_search_params_get_values,
-            lib.ada_free_search_params_values_iter,
-            self.paramsobj,
-        )
-        while lib.ada_search_params_values_iter_has_next(iterator):
-            item = lib.ada_search_params_values_iter_next(iterator)
-            yield _get_str(item)
+        if self._stale:
+            self._refresh()
+
+        return _SearchParamsIterator(self, 'values')
 
     def items(self) -> Iterator[Tuple[str, str]]:
-        iterator = _get_obj(
-            lib.ada_search_params_get_entries,
-            lib.ada_free_search_params_entries_iter,
-            self.paramsobj,
-        )
-        while lib.ada_search_params_entries_iter_has_next(iterator):
-            item = lib.ada_search_params_entries_iter_next(iterator)
-            yield _get_str(item.key), _get_str(item.value)
+        if self._stale:
+            self._refresh()
+
+        return _SearchParamsIterator(self, 'entries')
 
     def __repr__(self):
         return f'<SearchParams "{self}">'
 
     def __str__(self) -> str:
+        if self._stale:
+            self._refresh()
+
         result = _get_obj(
             lib.ada_search_params_to_string, lib.ada_free_owned_string, self.paramsobj
         )
         return _get_str(result)
 
 
+class _SearchParamsIterator:
+    # Iterates over the keys, values, or entries of a URLSearchParams object.
+    # The native iterator is freed when it's exhausted or closed.
+
+    def __init__(self, params: URLSearchParams, kind: str):
+        # The params object's __dict__ is checked to see if it's been closed
+        self._params = params
+        self._params_dict = params.__dict__
+        self._entries = kind == 'entries'
+        self._has_next = getattr(lib, f'ada_search_params_{kind}_iter_has_next')
+        self._next = getattr(lib, f'ada_search_params_{kind}_iter_next')
+        self._free = getattr(lib, f'ada_free_search_params_{kind}_iter')
+        get_iterator = getattr(lib, f'ada_search_params_get_{kind}')
+        self._iterator = _get_handle(self, get_iterator(params.paramsobj), self._free)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        iterator = self._iterator
+        if iterator is None:
+            raise StopIteration
+
+        if 'paramsobj' not in self._params_dict:
+            self.close()
+            raise ValueError('URLSearchParams is closed')
+
+        if not self._has_next(iterator):
+            self.close()
+            raise StopIteration
+
+        item = self._next(iterator)
+        if self._entries:
+            return _get_str(item.key), _get_str(item.value)
+
+        return _get_str(item)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        iterator = self._iterator
+        if iterator is not None:
+            self._iterator = None
+            _release_handle(self, iterator, self._free)
+
+
 def check_url(s: str) -> bool:
     """
     Returns ``True`` if *s* represents a valid URL, and ``False`` otherwise.
@@ -493,14 +1602,236 @@ def check_url(s: str) -> bool:
     except Exception:
         return False
 
-    urlobj = _get_obj(lib.ada_parse, lib.ada_free, s_bytes, len(s_bytes))
-    return lib.ada_is_valid(urlobj)
+    return lib.ada_can_parse(s_bytes, len(s_bytes))
+
+
+def check_urls(urls: Iterable[str]) -> bytearray:
+    """
+    Returns a ``bytearray`` with one item for each of the given *urls*:
+    ``1`` if it represents a valid URL, and ``0`` otherwise.
+
+    .. code-block:: python
+
+        >>> from ada_url import check_urls
+        >>> list(check_urls(['bogus', 'http://a/b/c/d;p?q']))
+        [0, 1]
+
+    """
+    can_parse = lib.ada_can_parse
+    ret = bytearray()
+    for s in urls:
+        try:
+            s_bytes = s.encode()
+        except Exception:
+            ret.append(0)
+            continue
+
+        ret.append(1 if can_parse(s_bytes, len(s_bytes)) else 0)
+
+    return ret
+
+
+def diagnose_urls(urls: Iterable[str]) -> bytearray:
+    """
+    Returns a ``bytearray`` with one item for each of the given *urls*: a
+    :class:`FailureType` value that describes why it's not valid, or ``0`` if it
+    is valid.
+
+    .. code-block:: python
+
+        >>> from ada_url import FailureType, diagnose_urls
+        >>> [FailureType(x) for x in diagnose_urls(['https://a.b', 'https://a:b'])]
+        [<FailureType.NONE: 0>, <FailureType.PORT: 7>]
+
+    Ada doesn't report the reason for a failure, so invalid URLs are categorized
+    by examining them separately. The categories are a best guess, but valid URLs
+    are checked as quickly as with :func:`check_urls`.
+    """
+    can_parse = lib.ada_can_parse
+    ret = bytearray()
+    for s in urls:
+        try:
+            s_bytes = s.encode()
+        except Exception:
+            ret.append(FailureType.OTHER)
+            continue
+
+        if can_parse(s_bytes, len(s_bytes)):
+            ret.append(FailureType.NONE)
+        else:
+            ret.append(_diagnose_failure(s))
+
+    return ret
+
 
+def _diagnose_failure(s: str) -> FailureType:
+    # Follows the outline of the basic URL parser to find the component that
+    # most likely made s invalid.
+    s = s.strip(_C0_CONTROL_OR_SPACE)
+    s = s.replace('\t', '').replace('\n', '').replace('\r', '')
+
+    match = _SCHEME_RE.match(s)
+    if match is None:
+        return FailureType.SCHEME
+
+    scheme = match.group(1).lower()
+    rest = s[match.end() :]
+    is_special = scheme in SPECIAL_SCHEMES
+    if is_special:
+        authority = rest.lstrip('/\\')
+        authority_end = _SPECIAL_AUTHORITY_END_RE.search(authority)
+    elif rest.startswith('//'):
+        authority = rest[2:]
+        authority_end = _AUTHORITY_END_RE.search(authority)
+    else:
+        return FailureType.OTHER
+
+    if authority_end is not None:
+        authority = authority[: authority_end.start()]
+
+    host = authority.rpartition('@')[2]
+    if host.startswith('['):
+        host, bracket, port = host.partition(']')
+        if (not bracket) or (port and (port[0] != ':')):
+            return FailureType.IPV6
+        port = port[1:]
+    else:
+        host, colon, port = host.partition(':')
+        if colon and (scheme == 'file'):
+            # file URLs can't have ports
+            return FailureType.PORT
+
+    if port and ((not port.isascii()) or (not port.isdigit()) or int(port) > 65535):
+        return FailureType.PORT
+
+    if host.startswith('['):
+        return FailureType.IPV6
+
+    if not is_special:
+        if not host:
+            return FailureType.HOST
+        if _FORBIDDEN_HOST_RE.search(host):
+            return FailureType.FORBIDDEN_CODE_POINT
+        return FailureType.OTHER
+
+    if not host:
+        return FailureType.OTHER if scheme == 'file' else FailureType.HOST
+
+    domain = percent_decode(host)
+    if _FORBIDDEN_DOMAIN_RE.search(domain):
+        return FailureType.FORBIDDEN_CODE_POINT
+
+    labels = normalize('NFKC', domain).lower().split('.')
+    if (len(labels) > 1) and (not labels[-1]):
+        labels.pop()
+    if _IPV4_NUMBER_RE.match(labels[-1]):
+        return FailureType.IPV4
+
+    return FailureType.HOST
+
+
+def group_by_origin(urls: Iterable[str]) -> List[int]:
+    """
+    Returns a list with a group number for each of the given *urls*. URLs with
+    the same origin get the same number, and numbers are assigned in the order
+    that origins are first seen.
+
+    .. code-block:: python
 
-def join_url(base_url: str, s: str) -> str:
+        >>> from ada_url import group_by_origin
+        >>> group_by_origin([
+        ...     'https://example.org/a',
+        ...     'https://example.org:443/b',
+        ...     'http://example.org/',
+        ...     'file:///tmp/x',
+        ...     'bogus',
+        ... ])
+        [0, 0, 1, 2, -1]
+
+    Origins are compared without being serialized. As in the WHATWG spec, each
+    URL with an opaque origin (e.g. ``file:`` and ``data:`` URLs) is in a group
+    of its own. Invalid URLs get ``-1``.
+    """
+    groups = {}
+    next_group = 0
+    ret = []
+    for s in urls:
+        try:
+            s_bytes = s.encode()
+        except Exception:
+            ret.append(-1)
+            continue
+
+        urlobj = lib.ada_parse(s_bytes, len(s_bytes))
+        try:
+            if not lib.ada_is_valid(urlobj):
+                ret.append(-1)
+                continue
+
+            key = _get_origin_key(urlobj)
+        finally:
+            lib.ada_free(urlobj)
+
+        group = None if key is None else groups.get(key)
+        if group is None:
+            group = next_group
+            next_group += 1
+            if key is not None:
+                groups[key] = group
+
+        ret.append(group)
+
+    return ret
+
+
+def _get_origin_obj(urlobj):
+    # Returns an ada_url object whose scheme, host, and port are those of the
+    # URL's origin, or None if the origin is opaque.
+    scheme_type = lib.ada_get_scheme_type(urlobj)
+    if scheme_type in _TUPLE_ORIGIN_SCHEME_TYPES:
+        return urlobj
+
+    if scheme_type != SchemeType.NOT_SPECIAL:
+        return None
+
+    protocol = lib.ada_get_protocol(urlobj)
+    if ffi.unpack(protocol.data, protocol.length) != b'blob:':
+        return None
+
+    # blob: URLs can have the origin of the URL in their path
+    origin = lib.ada_get_origin(urlobj)
+    try:
+        originobj = _get_obj(lib.ada_parse, lib.ada_free, origin.data, origin.length)
+    finally:
+        lib.ada_free_owned_string(origin)
+
+    if (not lib.ada_is_valid(originobj)) or (
+        lib.ada_get_scheme_type(originobj) not in _TUPLE_ORIGIN_SCHEME_TYPES
+    ):
+        return None
+
+    return originobj
+
+
+def _get_origin_key(urlobj) -> Optional[bytes]:
+    # Returns bytes that identify the URL's origin, or None if it's opaque. The
+    # first byte is the scheme type, and the rest is the host (with the port, if
+    # it's not the default).
+    originobj = _get_origin_obj(urlobj)
+    if originobj is None:
+        return None
+
+    host = lib.ada_get_host(originobj)
+    return _ORIGIN_KEY_PREFIXES[lib.ada_get_scheme_type(originobj)] + ffi.unpack(
+        host.data, host.length
+    )
+
+
+def join_url(base_url: str, s: str, *, default: Any = _marker) -> str:
     """
     Return the URL that results from joining *base_url* to *s*.
-    Raises ``ValueError`` if no valid URL can be constructed.
+    Raises ``ValueError`` if no valid URL can be constructed, unless a *default*
+    is given to return instead.
 
     .. code-block:: python
 
@@ -514,7 +1845,7 @@ def join_url(base_url: str, s: str) -> str:
         base_bytes = base_url.encode()
         s_bytes = s.encode()
     except Exception:
-        raise ValueError('Invalid URL') from None
+        return _invalid_url(default)
 
     urlobj = _get_obj(
         lib.ada_parse_with_base,
@@ -525,12 +1856,12 @@ def join_url(base_url: str, s: str) -> str:
         len(base_bytes),
     )
     if not lib.ada_is_valid(urlobj):
-        raise ValueError('Invalid URL') from None
+        return _invalid_url(default)
 
     return _get_str(lib.ada_get_href(urlobj))
 
 
-def normalize_url(s: str) -> str:
+def normalize_url(s: str, *, default: Any = _marker) -> str:
     """
     Returns a "normalized" URL with all ``'..'`` and ``'/'`` characters resolved.
 
@@ -540,11 +1871,37 @@ def normalize_url(s: str) -> str:
         >>> normalize_url('http://a/b/c/../g')
         'http://a/b/g'
 
+    ``ValueError`` is raised for invalid input, unless a *default* is given to
+    return instead.
+
+    .. code-block:: python
+
+        >>> normalize_url('bogus', default=None) is None
+        True
+
     """
-    return parse_url(s, attributes=('href',))['href']
+    try:
+        s_bytes = s.encode()
+    except Exception:
+        return _invalid_url(default)
+
+    urlobj = lib.ada_parse(s_bytes, len(s_bytes))
+    try:
+        if not lib.ada_is_valid(urlobj):
+            return _invalid_url(default)
+
+        return _get_str(lib.ada_get_href(urlobj))
+    finally:
+        lib.ada_free(urlobj)
 
 
-def parse_url(s: str, attributes: Iterable[str] = PARSE_ATTRIBUTES) -> ParseAttributes:
+def parse_url(
+    s: str,
+    attributes: Iterable[str] = PARSE_ATTRIBUTES,
+    *,
+    default: Any = _marker,
+    intern: Optional['InternTable'] = None,
+) -> ParseAttributes:
     """
     Returns a dictionary with the parsed components of the URL represented by *s*.
 
@@ -585,21 +1942,32 @@ def parse_url(s: str, attributes: Iterable[str] = PARSE_ATTRIBUTES) -> ParseAttr
 
     Unrecognized attributes are ignored.
 
+    ``ValueError`` is raised for invalid input, unless a *default* is given to
+    return instead.
+
+    Pass an :class:`InternTable` as *intern* to share the strings for repeated
+    components between calls.
+
     """
     try:
         s_bytes = s.encode()
     except Exception:
-        raise ValueError('Invalid URL') from None
+        return _invalid_url(default)
 
     ret = {}
     urlobj = _get_obj(lib.ada_parse, lib.ada_free, s_bytes, len(s_bytes))
     if not lib.ada_is_valid(urlobj):
-        raise ValueError('Invalid URL') from None
+        return _invalid_url(default)
 
+    interned = () if intern is None else intern.attributes
     for attr in attributes:
         get_func = getattr(lib, f'ada_get_{attr}')
         data = get_func(urlobj)
-        if attr == 'origin':
+        if attr in interned:
+            ret[attr] = intern._get(ffi.unpack(data.data, data.length))
+            if attr == 'origin':
+                lib.ada_free_owned_string(data)
+        elif attr == 'origin':
             ret[attr] = _get_str(data)
             lib.ada_free_owned_string(data)
         elif attr == 'host_type':
@@ -612,7 +1980,7 @@ def parse_url(s: str, attributes: Iterable[str] = PARSE_ATTRIBUTES) -> ParseAttr
     return ret
 
 
-def replace_url(s: str, **kwargs: str) -> str:
+def replace_url(s: str, *, default: Any = _marker, **kwargs: str) -> str:
     """
     Start with the URL represented by *s*, replace the attributes given in the *kwargs*
     mapping, and return a normalized URL with the result.
@@ -629,16 +1997,17 @@ def replace_url(s: str, **kwargs: str) -> str:
     Unrecognized attributes are ignored. ``href`` is replaced first if it is given.
     ``hostname`` is replaced before ``host`` if both are given.
 
-    ``ValueError`` is raised if the input URL or one of the components is not valid.
+    ``ValueError`` is raised if the input URL or one of the components is not valid,
+    unless a *default* is given to return instead.
     """
     try:
         s_bytes = s.encode()
     except Exception:
-        raise ValueError('Invalid URL') from None
+        return _invalid_url(default)
 
     urlobj = _get_obj(lib.ada_parse, lib.ada_free, s_bytes, len(s_bytes))
     if not lib.ada_is_valid(urlobj):
-        raise ValueError('Invalid URL') from None
+        return _invalid_url(default)
 
     # We process attributes in the order given by the documentation, e.g.
     # href before anything else.
@@ -650,7 +2019,7 @@ def replace_url(s: str, **kwargs: str) -> str:
         try:
             value_bytes = value.encode()
         except Exception:
-            raise ValueError(f'Invalid value for {attr}') from None
+            return _invalid_url(default, f'Invalid value for {attr}')
 
         if (not value_bytes) and (attr in CLEAR_ATTRIBUTES):
             clear_func = getattr(lib, f'ada_clear_{attr}')
@@ -659,7 +2028,7 @@ def replace_url(s: str, **kwargs: str) -> str:
             set_func = getattr(lib, f'ada_set_{attr}')
             set_result = set_func(urlobj, value_bytes, len(value_bytes))
             if (set_result is not None) and (not set_result):
-                raise ValueError(f'Invalid value for {attr}') from None
+                return _invalid_url(default, f'Invalid value for {attr}')
 
     return _get_str(lib.ada_get_href(urlobj))
 
@@ -711,6 +2080,1067 @@ def replace_search_params(s: str, *args: Tuple[str, str]) -> str:
     return str(search_params)
 
 
+def extract_urls(
+    text_or_buffer: Union[str, bytes, bytearray, memoryview],
+    base: Optional[str] = None,
+) -> List[Tuple[int, int, str]]:
+    """
+    Finds the URLs in *text_or_buffer* and returns a list of
+    ``(offset, length, href)`` tuples, where *href* is the normalized URL.
+
+    .. code-block:: python
+
+        >>> from ada_url import extract_urls
+        >>> extract_urls('See https://example.org/a?b=1 (or www.example.com).')
+        [(4, 25, 'https://example.org/a?b=1'), (34, 15, 'http://www.example.com/')]
+
+    Candidates start with a scheme followed by ``://``, with ``www.``, or with
+    ``mailto:``. They end at whitespace, quotes, or angle brackets. Trailing
+    punctuation and unbalanced closing brackets are not included. Candidates
+    that aren't valid URLs are skipped.
+
+    *text_or_buffer* can be a ``str`` or any bytes-like object, such as ``bytes``
+    or ``mmap.mmap``. Offsets and lengths count characters for ``str`` input and
+    bytes otherwise, so byte buffers are scanned without being decoded.
+
+    Candidates that start with ``www.`` have no scheme. They are resolved against
+    *base* if it's given, so they take its scheme, and they use ``http:``
+    otherwise. ``ValueError`` is raised if *base* is not a valid URL.
+    """
+    is_text = isinstance(text_or_buffer, str)
+    prescan_re, scheme_chars_re, letter_re, body_re, word_char_re = (
+        _URL_SCANNER if is_text else _URL_BYTES_SCANNER
+    )
+    # Slices of memoryview objects are converted to bytes before being used
+    text_type = str if is_text else bytes
+    base_url = None if base is None else BaseURL(base)
+
+    parse = lib.ada_parse
+    is_valid = lib.ada_is_valid
+    free = lib.ada_free
+    ret = []
+    pos = 0
+    while True:
+        match = prescan_re.search(text_or_buffer, pos)
+        if match is None:
+            break
+
+        hit_start, hit_end = match.span()
+        pos = hit_end
+        # The hit is "://" (3 characters), "www." (4), or "mailto:" (7)
+        is_www = hit_end - hit_start == 4
+        if hit_end - hit_start == 3:
+            # Matching forward from the hit in a reversed copy of the text
+            # before it finds the scheme without backtracking.
+            window_start = max(hit_start - _URL_MAX_SCHEME_LENGTH, 0)
+            window = text_type(text_or_buffer[window_start:hit_start])[::-1]
+            scheme = window[: scheme_chars_re.match(window).end()][::-1]
+            letter = letter_re.search(scheme)
+            if letter is None:
+                continue
+            start = hit_start - len(scheme) + letter.start()
+        else:
+            if hit_start and word_char_re.match(text_or_buffer, hit_start - 1):
+                continue
+            start = hit_start
+
+        end = body_re.match(text_or_buffer, hit_end).end()
+        candidate = text_type(text_or_buffer[start:end])
+        if is_text:
+            length = _trim_url_candidate(candidate)
+            candidate = candidate[:length]
+            try:
+                url_bytes = candidate.encode()
+            except UnicodeEncodeError:
+                continue
+        else:
+            # latin-1 maps each byte to one code point, so lengths are unchanged
+            length = _trim_url_candidate(candidate.decode('latin-1'))
+            url_bytes = candidate[:length]
+
+        if start + length <= hit_end:
+            continue
+
+        if is_www and (base_url is not None):
+            href = base_url._join(b'//' + url_bytes)
+            if href is None:
+                continue
+        else:
+            if is_www:
+                url_bytes = b'http://' + url_bytes
+            urlobj = parse(url_bytes, len(url_bytes))
+            try:
+                if not is_valid(urlobj):
+                    continue
+                href = _get_str(lib.ada_get_href(urlobj))
+            finally:
+                free(urlobj)
+
+        ret.append((start, length, href))
+        pos = start + length
+
+    return ret
+
+
+def rewrite_links(
+    html: Union[str, bytes, Iterable[bytes], Any],
+    base: str,
+    rewrite: Union[Callable[[str], Optional[str]], Dict[str, str]],
+    attributes: Iterable[str] = LINK_ATTRIBUTES,
+) -> Union[str, bytes, Iterator[bytes]]:
+    """
+    Resolves the URLs in the link attributes of *html* against *base*, and
+    replaces them with the result of *rewrite*.
+
+    .. code-block:: python
+
+        >>> from ada_url import rewrite_links
+        >>> html = '<a href="../b?x=1&amp;y=2">B</a> <img srcset="i.png 1x, /j.png 2x">'
+        >>> rewrite_links(html, 'https://example.org/a/', lambda url: url.upper())
+        '<a href="HTTPS://EXAMPLE.ORG/B?X=1&amp;Y=2">B</a> <img srcset="HTTPS://EXAMPLE.ORG/A/I.PNG 1x, HTTPS://EXAMPLE.ORG/J.PNG 2x">'
+
+    *rewrite* can be a function that takes the resolved URL and returns its
+    replacement, or ``None`` to leave it as it was. It can also be a ``dict``
+    that maps URL prefixes to replacements, in which case the longest matching
+    prefix is replaced and URLs that don't match are left as they were:
+
+    .. code-block:: python
+
+        >>> rules = {'https://example.org/': 'https://proxy.example/example.org/'}
+        >>> rewrite_links(b'<a href=/x>', 'https://example.org/', rules)
+        b'<a href="https://proxy.example/example.org/x">'
+
+    The ``href``, ``src``, ``action``, and ``srcset`` attributes of any element
+    are rewritten by default; pass a sequence of names as *attributes* to change
+    that. Character references in values are decoded before they are resolved.
+    Empty values, values that start with ``#``, and values that can't be
+    resolved are left as they were. So is everything outside of the rewritten
+    values, including comments and the content of ``<script>`` and ``<style>``
+    elements.
+
+    The first ``<base href>`` element changes the base URL for the links that
+    come after it. (HTML requires it to come before any other links.)
+
+    *html* can be a ``str``, which gives a ``str``, or a bytes-like object,
+    which gives ``bytes``. It can also be a binary file object or an iterable of
+    ``bytes`` chunks, in which case an iterator of output chunks is returned.
+    Bytes are treated as UTF-8, and invalid sequences are passed through as
+    they were.
+    """
+    if isinstance(rewrite, dict):
+        rewrite = _get_prefix_rewriter(rewrite)
+    attributes = frozenset(attr.lower() for attr in attributes)
+    rewriter = _LinkRewriter(BaseURL(base), rewrite, attributes)
+
+    if isinstance(html, str):
+        return rewriter.feed(html, final=True)
+
+    if isinstance(html, (bytes, bytearray, memoryview)):
+        text = str(html, 'utf-8', 'surrogateescape')
+        return rewriter.feed(text, final=True).encode('utf-8', 'surrogateescape')
+
+    if hasattr(html, 'read'):
+        chunks = iter(lambda: html.read(_REWRITE_CHUNK_SIZE), b'')
+    else:
+        chunks = iter(html)
+
+    return _rewrite_chunks(rewriter, chunks)
+
+
+def _rewrite_chunks(rewriter: '_LinkRewriter', chunks: Iterator[bytes]):
+    decoder = getincrementaldecoder('utf-8')('surrogateescape')
+    for chunk in chunks:
+        out = rewriter.feed(decoder.decode(chunk))
+        if out:
+            yield out.encode('utf-8', 'surrogateescape')
+
+    out = rewriter.feed(decoder.decode(b'', final=True), final=True)
+    if out:
+        yield out.encode('utf-8', 'surrogateescape')
+
+
+def _get_prefix_rewriter(rules: Dict[str, str]) -> Callable[[str], Optional[str]]:
+    prefixes = sorted(rules, key=len, reverse=True)
+
+    def rewrite(url: str) -> Optional[str]:
+        for prefix in prefixes:
+            if url.startswith(prefix):
+                return rules[prefix] + url[len(prefix) :]
+
+        return None
+
+    return rewrite
+
+
+class _LinkRewriter:
+    # Rewrites the links in HTML that's given in pieces. Text that might be the
+    # start of an incomplete tag is held until the next piece. The content of
+    # comments and raw text elements is passed through as it arrives, with the
+    # pattern for their end kept in raw_text_end.
+
+    def __init__(self, base: BaseURL, rewrite, attributes):
+        self.base = base
+        self.rewrite = rewrite
+        self.attributes = attributes
+        self.pending = ''
+        self.raw_text_end = None
+        self.seen_base = False
+        # Resolved and rewritten values, by original value
+        self.cache = {}
+
+    def feed(self, text: str, final: bool = False) -> str:
+        text = self.pending + text
+        out = []
+        position = 0
+        # Where the last complete construct ended, and where the text that's
+        # held for the next piece starts
+        scanned = 0
+        end = None
+        while end is None:
+            if self.raw_text_end is not None:
+                match = self.raw_text_end.search(text, scanned)
+                if match is None:
+                    end = len(text)
+                    if not final:
+                        # Hold anything that might be the start of the end
+                        partial_match = _HTML_PARTIAL_END_RE.search(text, scanned)
+                        if partial_match is not None:
+                            end = partial_match.start()
+                    break
+                self.raw_text_end = None
+                scanned = match.end()
+
+            for match in _HTML_SCANNER_RE.finditer(text, scanned):
+                scanned = match.end()
+                if match.group(3) is not None:
+                    tag_name, attributes_group = match.group(3), 4
+                    # An element whose content hasn't all arrived yet
+                    self.raw_text_end = _HTML_RAW_TEXT_END_RES.get(tag_name.lower())
+                elif match.group(1) is not None:
+                    tag_name, attributes_group = match.group(1), 2
+                else:
+                    # A comment that hasn't been closed yet
+                    if not match.group().endswith('-->'):
+                        self.raw_text_end = _HTML_COMMENT_END_RE
+                        break
+                    continue
+
+                attributes_start, attributes_end = match.span(attributes_group)
+                changes = self._rewrite_attributes(
+                    tag_name.lower(), text, attributes_start, attributes_end
+                )
+                for start, stop, value in changes:
+                    out.append(text[position:start])
+                    out.append(value)
+                    position = stop
+                if self.raw_text_end is not None:
+                    break
+            else:
+                end = len(text)
+                if not final:
+                    pending_match = _HTML_CONSTRUCT_START_RE.search(text, scanned)
+                    if (pending_match is not None) and (
+                        len(text) - pending_match.start() <= _REWRITE_MAX_PENDING
+                    ):
+                        end = pending_match.start()
+
+        out.append(text[position:end])
+        self.pending = text[end:]
+        return ''.join(out)
+
+    def _rewrite_attributes(self, tag_name: str, text: str, start: int, end: int):
+        # Returns (start, end, replacement) for the values that are rewritten
+        ret = []
+        for match in _HTML_ATTRIBUTE_RE.finditer(text, start, end):
+            name = match.group(1).lower()
+            if name not in self.attributes:
+                continue
+
+            for group, quote in ((2, '"'), (3, "'"), (4, None)):
+                value = match.group(group)
+                if value is not None:
+                    break
+            else:
+                continue
+
+            if (tag_name == 'base') and (name == 'href') and (not self.seen_base):
+                self.seen_base = True
+                base_href = self._resolve(value)
+                if base_href is not None:
+                    self.base = BaseURL(base_href)
+                    self.cache.clear()
+
+            if name == 'srcset':
+                replacement = self._rewrite_srcset(value, quote)
+            else:
+                replacement = self._rewrite_value(value)
+                if replacement is not None:
+                    replacement = _escape_attribute_value(replacement, quote)
+            if replacement is None:
+                continue
+
+            value_start, value_end = match.span(group)
+            if quote is None:
+                ret.append((value_start, value_end, f'"{replacement}"'))
+            else:
+                ret.append((value_start, value_end, replacement))
+
+        return ret
+
+    def _resolve(self, value: str) -> Optional[str]:
+        if '&' in value:
+            value = _HTML_CHARREF_RE.sub(_unescape_attribute_charref, value)
+        value = value.strip(_HTML_WHITESPACE)
+        if (not value) or value.startswith('#'):
+            return None
+
+        try:
+            value_bytes = value.encode()
+        except Exception:
+            return None
+
+        return self.base._join(value_bytes)
+
+    def _rewrite_value(self, value: str) -> Optional[str]:
+        # Returns the unescaped replacement for an attribute value
+        try:
+            return self.cache[value]
+        except KeyError:
+            pass
+
+        href = self._resolve(value)
+        ret = None if href is None else self.rewrite(href)
+        self.cache[value] = ret
+        return ret
+
+    def _rewrite_srcset(self, value: str, quote: Optional[str]) -> Optional[str]:
+        # Rewrites each image candidate's URL, keeping the separators and
+        # descriptors between them. Returns the escaped attribute value.
+        out = []
+        changed = False
+        position = 0
+        while position < len(value):
+            separator_end = _SRCSET_SEPARATOR_RE.match(value, position).end()
+            out.append(value[position:separator_end])
+            position = separator_end
+            if position >= len(value):
+                break
+
+            url_end = _SRCSET_URL_RE.match(value, position).end()
+            url = value[position:url_end].rstrip(',')
+            position += len(url)
+            if position == url_end:
+                descriptors_end = _SRCSET_DESCRIPTORS_RE.match(value, position).end()
+            else:
+                descriptors_end = position
+
+            replacement = self._rewrite_value(url)
+            if replacement is None:
+                out.append(url)
+            else:
+                out.append(_escape_attribute_value(replacement, quote))
+                changed = True
+            out.append(value[position:descriptors_end])
+            position = descriptors_end
+
+        return ''.join(out) if changed else None
+
+
+def _unescape_attribute_charref(match: re.Match) -> str:
+    # In attribute values, named references without a semicolon are only
+    # decoded if they're not followed by "=" (as in "?a=1&copy=2")
+    name, semicolon = match.groups()
+    if (name is not None) and (not semicolon):
+        followed_by = match.string[match.end() : match.end() + 1]
+        if (name not in html5_entities) or (followed_by == '='):
+            return match.group()
+
+    return html_unescape(match.group())
+
+
+def _escape_attribute_value(value: str, quote: Optional[str]) -> str:
+    value = value.replace('&', '&amp;')
+    if quote == "'":
+        return value.replace("'", '&#39;')
+
+    return value.replace('"', '&quot;')
+
+
+def _trim_url_candidate(candidate: str) -> int:
+    # Returns the length of candidate after removing trailing punctuation and
+    # closing brackets that don't have a matching opening bracket.
+    end = len(candidate)
+    while end:
+        last = candidate[end - 1]
+        if last in _URL_TRAILING_PUNCTUATION:
+            end -= 1
+        elif (last in _URL_CLOSING_BRACKETS) and (
+            candidate.count(_URL_CLOSING_BRACKETS[last], 0, end)
+            < candidate.count(last, 0, end)
+        ):
+            end -= 1
+        else:
+            break
+
+    return end
+
+
+def surt(
+    url: str,
+    strip_www: bool = True,
+    strip_trailing_slash: bool = True,
+    sort_query: bool = True,
+    include_scheme: bool = False,
+    lowercase: bool = True,
+) -> str:
+    """
+    Returns the `SURT <http://crawler.archive.org/articles/user_manual/glossary.html#surt>`__
+    (Sort-friendly URI Reordering Transform) key for *url*, as used in web
+    archive CDX indexes.
+
+    .. code-block:: python
+
+        >>> from ada_url import surt
+        >>> surt('https://www.Example.com:8080/Path/?b=2&a=1#frag')
+        'com,example:8080)/path?a=1&b=2'
+        >>> surt('https://www.example.com/', include_scheme=True)
+        'https://(com,example)/'
+
+    The URL is normalized first, and the key is made from its host (with the
+    labels reversed), port, path, and query. The credentials and fragment are
+    not included. URLs without a host, like ``mailto:`` URLs, give keys like
+    ``mailto:user@example.org``.
+
+    * *strip_www* removes a leading ``www``, ``www1``, etc. label from the host.
+    * *strip_trailing_slash* removes a ``/`` from the end of the path, unless the
+      path is just ``/``.
+    * *sort_query* sorts the ``&``-separated parts of the query.
+    * *include_scheme* adds the scheme, as in ``https://(com,example)/``.
+    * *lowercase* lowercases the path and query (hosts are always lowercase).
+
+    ``ValueError`` is raised if *url* is not valid.
+    """
+    return surt_many(
+        (url,),
+        strip_www=strip_www,
+        strip_trailing_slash=strip_trailing_slash,
+        sort_query=sort_query,
+        include_scheme=include_scheme,
+        lowercase=lowercase,
+    )[0]
+
+
+def surt_many(
+    urls: Iterable[str],
+    strip_www: bool = True,
+    strip_trailing_slash: bool = True,
+    sort_query: bool = True,
+    include_scheme: bool = False,
+    lowercase: bool = True,
+) -> List[str]:
+    """
+    Returns a list with the :func:`surt` key for each of the given *urls*.
+    The options are the same as for :func:`surt`.
+    """
+    parse = lib.ada_parse
+    is_valid = lib.ada_is_valid
+    free = lib.ada_free
+    get_href = lib.ada_get_href
+    get_components = lib.ada_get_components
+    unpack = ffi.unpack
+    ret = []
+    for s in urls:
+        try:
+            s_bytes = s.encode()
+        except Exception:
+            raise ValueError('Invalid URL') from None
+
+        urlobj = parse(s_bytes, len(s_bytes))
+        try:
+            if not is_valid(urlobj):
+                raise ValueError('Invalid URL') from None
+
+            href_data = get_href(urlobj)
+            href_bytes = unpack(href_data.data, href_data.length)
+            spans = _get_spans(href_bytes, get_components(urlobj))
+        finally:
+            free(urlobj)
+
+        # Normalized hrefs are ASCII, so the spans are also character positions
+        href = href_bytes.decode()
+        (
+            _,
+            _,
+            _,
+            (protocol_start, protocol_end),
+            (port_start, port_end),
+            (hostname_start, hostname_end),
+            _,
+            (pathname_start, pathname_end),
+            (search_start, search_end),
+            _,
+        ) = spans
+
+        path = href[pathname_start:pathname_end]
+        if strip_trailing_slash and (len(path) > 1) and path.endswith('/'):
+            path = path[:-1]
+        query = href[search_start:search_end]
+        if lowercase:
+            path = path.lower()
+            query = query.lower()
+        if sort_query and query:
+            query = '?' + '&'.join(sorted(query[1:].split('&')))
+
+        if hostname_start == hostname_end:
+            ret.append(f'{href[protocol_start:protocol_end]}{path}{query}')
+            continue
+
+        labels = href[hostname_start:hostname_end].split('.')
+        if strip_www and (len(labels) > 1) and _WWW_LABEL_RE.match(labels[0]):
+            del labels[0]
+        labels.reverse()
+        host = ','.join(labels)
+        if port_start != port_end:
+            host = f'{host}:{href[port_start:port_end]}'
+
+        if include_scheme:
+            ret.append(f'{href[protocol_start:protocol_end]}//({host}){path}{query}')
+        else:
+            ret.append(f'{host}){path}{query}')
+
+    return ret
+
+
+class Canonicalizer:
+    """
+    Canonicalizes URLs beyond WHATWG normalization, e.g. to make cache keys or
+    to find duplicates. The rules to apply are given by the *profile*.
+
+    .. code-block:: python
+
+        >>> from ada_url import Canonicalizer
+        >>> canonicalizer = Canonicalizer()
+        >>> canonicalizer.canonicalize(
+        ...     'https://Example.org/a/index.html?utm_source=x&b=2&a=1#top'
+        ... )
+        'https://example.org/a/?a=1&b=2'
+        >>> canonicalizer.canonicalize_many(['https://a.example/?fbclid=x'])
+        ['https://a.example/']
+
+    *profile* is a ``dict`` that can have these keys. Keys that aren't given
+    take their values from ``DEFAULT_CANONICALIZATION_PROFILE``:
+
+    * ``strip_params``: query parameter names to remove. ``*`` matches any
+      characters, as in ``utm_*``. The default is ``TRACKING_PARAMETERS``.
+    * ``sort_query``: if ``True`` (the default), the query parameters are sorted
+      by name. Parameters with the same name stay in their original order.
+    * ``drop_fragment``: if ``True`` (the default), the fragment is removed.
+    * ``index_files``: file names that are removed from the end of the path,
+      ignoring case. The default includes ``index.html`` and ``default.aspx``.
+    * ``lowercase_path_hosts``: hostnames whose paths are lowercased, for servers
+      that ignore case. ``*`` matches any characters, as in ``*.example.org``.
+      The default is empty.
+
+    The URL is parsed once, and the rules are applied to the normalized result.
+    ``ValueError`` is raised if the URL is invalid or *profile* has an unknown
+    key.
+    """
+
+    def __init__(self, profile: Optional[Dict[str, Any]] = None):
+        options = dict(DEFAULT_CANONICALIZATION_PROFILE)
+        for key, value in (profile or {}).items():
+            if key not in options:
+                raise ValueError(f'Unknown canonicalization option: {key}')
+            options[key] = value
+
+        self.profile = options
+        self._strip_params_re = _compile_fnmatch(options['strip_params'])
+        self._sort_query = options['sort_query']
+        self._drop_fragment = options['drop_fragment']
+        self._index_files = frozenset(name.lower() for name in options['index_files'])
+        self._lowercase_path_hosts_re = _compile_fnmatch(
+            host.lower() for host in options['lowercase_path_hosts']
+        )
+
+    def canonicalize(self, url: str) -> str:
+        """
+        Returns the canonical form of *url*.
+        """
+        return self.canonicalize_many((url,))[0]
+
+    def canonicalize_many(self, urls: Iterable[str]) -> List[str]:
+        """
+        Returns a list with the canonical form of each of the given *urls*.
+        """
+        parse = lib.ada_parse
+        is_valid = lib.ada_is_valid
+        free = lib.ada_free
+        get_href = lib.ada_get_href
+        get_components = lib.ada_get_components
+        unpack = ffi.unpack
+        strip_params_re = self._strip_params_re
+        sort_query = self._sort_query
+        drop_fragment = self._drop_fragment
+        index_files = self._index_files
+        lowercase_path_hosts_re = self._lowercase_path_hosts_re
+        ret = []
+        for s in urls:
+            try:
+                s_bytes = s.encode()
+            except Exception:
+                raise ValueError('Invalid URL') from None
+
+            urlobj = parse(s_bytes, len(s_bytes))
+            try:
+                if not is_valid(urlobj):
+                    raise ValueError('Invalid URL') from None
+
+                href_data = get_href(urlobj)
+                href_bytes = unpack(href_data.data, href_data.length)
+                spans = _get_spans(href_bytes, get_components(urlobj))
+            finally:
+                free(urlobj)
+
+            # Normalized hrefs are ASCII, so the spans are also character positions
+            href = href_bytes.decode()
+            (
+                _,
+                _,
+                _,
+                _,
+                _,
+                (hostname_start, hostname_end),
+                _,
+                (pathname_start, pathname_end),
+                (search_start, search_end),
+                (hash_start, hash_end),
+            ) = spans
+
+            path = href[pathname_start:pathname_end]
+            if index_files and path.startswith('/'):
+                last_slash = path.rfind('/')
+                if path[last_slash + 1 :].lower() in index_files:
+                    path = path[: last_slash + 1]
+            if (lowercase_path_hosts_re is not None) and lowercase_path_hosts_re.match(
+                href[hostname_start:hostname_end]
+            ):
+                path = path.lower()
+
+            query = href[search_start:search_end]
+            if query and ((strip_params_re is not None) or sort_query):
+                params = []
+                for param in query[1:].split('&'):
+                    if not param:
+                        continue
+                    if (strip_params_re is not None) and strip_params_re.match(
+                        param.partition('=')[0]
+                    ):
+                        continue
+                    params.append(param)
+                if sort_query:
+                    params.sort(key=_get_param_name)
+                query = ('?' + '&'.join(params)) if params else ''
+
+            fragment = '' if drop_fragment else href[hash_start:hash_end]
+            ret.append(f'{href[:pathname_start]}{path}{query}{fragment}')
+
+        return ret
+
+
+def _compile_fnmatch(patterns: Iterable[str]) -> Optional[re.Pattern]:
+    # Combines shell-style patterns into one regular expression
+    patterns = [translate(pattern) for pattern in patterns]
+    if not patterns:
+        return None
+
+    return re.compile('|'.join(patterns))
+
+
+def _get_param_name(param: str) -> str:
+    return param.partition('=')[0]
+
+
+class URLTemplate:
+    """
+    A URL with ``{name}`` placeholders, which is parsed and validated once so
+    that URLs can be built from it quickly.
+
+    .. code-block:: python
+
+        >>> from ada_url import URLTemplate
+        >>> template = URLTemplate('https://{host}/api/v2/{id}?page={n}')
+        >>> template.expand(host='Example.org', id='a b', n=2)
+        'https://example.org/api/v2/a%20b?page=2'
+        >>> template.expand_many([{'host': 'example.org', 'id': 1, 'n': 'x&y'}])
+        ['https://example.org/api/v2/1?page=x%26y']
+
+    The text around the placeholders is normalized when the template is created.
+    When it's expanded, each value is converted with ``str()`` and
+    percent-encoded according to where it is:
+
+    * Values in the username and password use the ``userinfo`` set.
+    * Values in the path use the ``path`` set, so ``/`` can separate segments.
+    * Values in the query use the ``component`` set, so ``&`` and ``=`` in a
+      value don't start a new parameter.
+    * Values in the fragment use the ``fragment`` set.
+
+    Values in the host are combined with the rest of the host, which is then
+    validated and normalized (with IDNA processing for special URLs). Recently
+    seen hosts are cached.
+
+    The result is the same as parsing the template with the encoded values
+    substituted, but without a full parse for each URL. Values that add ``.`` or
+    ``..`` path segments or make the path start with ``//``, empty usernames
+    and passwords, and ``file:`` URLs are handled by parsing the result.
+
+    ``ValueError`` is raised if the template is not a valid URL, or if it has
+    placeholders in the scheme or port. It's also raised by :meth:`expand`
+    if a value can't be used in its position, and ``KeyError`` is raised if a
+    value is missing.
+    """
+
+    def __init__(self, template: str):
+        self.template = template
+        names = _TEMPLATE_FIELD_RE.findall(template)
+        self.fields = tuple(dict.fromkeys(names))
+
+        # Parse a version of the template with a unique token for each
+        # placeholder, and find where the tokens end up in the result.
+        prefix = 'adatpl'
+        while prefix in template.lower():
+            prefix += 'x'
+        tokens = [f'{prefix}{i}z' for i in range(len(names))]
+        token_iter = iter(tokens)
+        probe = _TEMPLATE_FIELD_RE.sub(lambda match: next(token_iter), template)
+        try:
+            probe_bytes = probe.encode()
+        except Exception:
+            raise ValueError('Invalid URL template') from None
+
+        urlobj = _get_obj(lib.ada_parse, lib.ada_free, probe_bytes, len(probe_bytes))
+        if not lib.ada_is_valid(urlobj):
+            raise ValueError('Invalid URL template')
+
+        href_value = lib.ada_get_href(urlobj)
+        href_bytes = ffi.unpack(href_value.data, href_value.length)
+        spans = _get_spans(href_bytes, lib.ada_get_components(urlobj))
+        href = href_bytes.decode()
+        is_special = lib.ada_get_scheme_type(urlobj) != SchemeType.NOT_SPECIAL
+        self._protocol = href[slice(*spans[_SPAN_INDEXES['protocol']])]
+        self._needs_parse = lib.ada_get_scheme_type(urlobj) == SchemeType.FILE
+
+        # Each part is (kind, value, encode_set, component), where kind is
+        # _TEMPLATE_LITERAL or _TEMPLATE_FIELD. Host parts are grouped together.
+        hostname_start, hostname_end = spans[_SPAN_INDEXES['hostname']]
+        pathname_start, pathname_end = spans[_SPAN_INDEXES['pathname']]
+        boundaries = sorted(
+            {hostname_start, hostname_end, pathname_start, pathname_end}
+        )
+        parts = []
+        position = 0
+        for name, token in zip(names, tokens):
+            start = href.find(token, position)
+            if (start == -1) or (href.count(token) != 1):
+                raise ValueError('Invalid URL template')
+            end = start + len(token)
+
+            component = _get_template_component(spans, start, end)
+            if component is None:
+                raise ValueError('Placeholders are not allowed in the scheme or port')
+
+            parts.extend(
+                _split_template_literal(href, position, start, boundaries, spans)
+            )
+            parts.append(
+                (_TEMPLATE_FIELD, name, _TEMPLATE_ENCODE_SETS[component], component)
+            )
+            position = end
+        parts.extend(
+            _split_template_literal(href, position, len(href), boundaries, spans)
+        )
+
+        # Merge the host parts into a single group, which is normalized as a whole
+        self._parts = []
+        host_parts = None
+        for part in parts:
+            if part[3] != 'hostname':
+                self._parts.append(part)
+            elif host_parts is None:
+                host_parts = [part]
+                self._parts.append((_TEMPLATE_HOST, host_parts, None, 'hostname'))
+            else:
+                host_parts.append(part)
+
+        self._has_path_fields = any(
+            (kind == _TEMPLATE_FIELD) and (component == 'pathname')
+            for kind, _, _, component in self._parts
+        )
+        self._is_special = is_special
+
+    def __repr__(self):
+        return f'<URLTemplate "{self.template}">'
+
+    def expand(self, **values: Any) -> str:
+        """
+        Returns the URL that results from substituting the given *values* for the
+        placeholders.
+        """
+        return self._expand(values)
+
+    def expand_many(self, rows: Iterable[Dict[str, Any]]) -> List[str]:
+        """
+        Returns a list with the result of :meth:`expand` for each ``dict`` of
+        values in *rows*.
+        """
+        expand = self._expand
+        return [expand(values) for values in rows]
+
+    def _expand(self, values: Dict[str, Any]) -> str:
+        out = []
+        path = [] if self._has_path_fields else None
+        check_path = False
+        needs_parse = self._needs_parse
+        for kind, value, encode_set, component in self._parts:
+            if kind == _TEMPLATE_LITERAL:
+                text = value
+            elif kind == _TEMPLATE_FIELD:
+                text = str(values[value])
+                if component == 'pathname':
+                    if self._is_special:
+                        text = text.replace('\\', '/')
+                    # Empty values and dots could create "." and ".." segments,
+                    # and a leading "/" could make the path look like a host
+                    check_path = (
+                        check_path
+                        or (not text)
+                        or ('.' in text)
+                        or ('%' in text)
+                        or text.startswith('/')
+                    )
+                elif (not text) and (encode_set == 'userinfo'):
+                    # Empty credentials leave a ":" or "@" that parsing removes
+                    needs_parse = True
+                text = percent_encode(text, encode_set)
+                if (component == 'search') and self._is_special:
+                    # The query of a special URL also has "'" encoded
+                    text = text.replace("'", '%27')
+            else:
+                host = ''.join(
+                    part[1] if part[0] == _TEMPLATE_LITERAL else str(values[part[1]])
+                    for part in value
+                )
+                text = _normalize_template_host(self._protocol, host)
+
+            out.append(text)
+            if (path is not None) and (component == 'pathname'):
+                path.append(text)
+
+        ret = ''.join(out)
+        if check_path:
+            path_text = ''.join(path)
+            needs_parse = (
+                needs_parse
+                or path_text.startswith('//')
+                or (_DOT_SEGMENT_RE.search(path_text) is not None)
+            )
+        if needs_parse:
+            return normalize_url(ret)
+
+        return ret
+
+
+def _get_template_component(spans, start: int, end: int) -> Optional[str]:
+    # Returns the name of the component that holds href[start:end], if it's one
+    # that can have placeholders.
+    for component in ('username', 'password', 'hostname', 'pathname', 'search', 'hash'):
+        span_start, span_end = spans[_SPAN_INDEXES[component]]
+        if span_start <= start and end <= span_end:
+            return component
+
+    return None
+
+
+def _split_template_literal(href: str, start: int, end: int, boundaries, spans):
+    # Splits href[start:end] at the hostname and pathname boundaries, so that
+    # each literal part belongs to a single component.
+    hostname_span = spans[_SPAN_INDEXES['hostname']]
+    pathname_span = spans[_SPAN_INDEXES['pathname']]
+    ret = []
+    cuts = [start] + [b for b in boundaries if start < b < end] + [end]
+    for cut_start, cut_end in zip(cuts, cuts[1:]):
+        if cut_start == cut_end:
+            continue
+        if hostname_span[0] <= cut_start and cut_end <= hostname_span[1]:
+            component = 'hostname'
+        elif pathname_span[0] <= cut_start and cut_end <= pathname_span[1]:
+            component = 'pathname'
+        else:
+            component = None
+        ret.append((_TEMPLATE_LITERAL, href[cut_start:cut_end], None, component))
+
+    return ret
+
+
+@lru_cache(maxsize=4096)
+def _normalize_template_host(protocol: str, host: str) -> str:
+    # Returns the normalized form of a host that was built from a template,
+    # checking that it doesn't add any other components to the URL.
+    try:
+        href_bytes = f'{protocol}//{host}/'.encode()
+    except Exception:
+        raise ValueError('Invalid host') from None
+
+    urlobj = lib.ada_parse(href_bytes, len(href_bytes))
+    try:
+        if not lib.ada_is_valid(urlobj):
+            raise ValueError('Invalid host')
+        href = _get_str(lib.ada_get_href(urlobj))
+        hostname = _get_str(lib.ada_get_hostname(urlobj))
+    finally:
+        lib.ada_free(urlobj)
+
+    # Values that add a port, credentials, or a path aren't allowed
+    if (not hostname) or (href != f'{protocol}//{hostname}/'):
+        raise ValueError('Invalid host')
+
+    return hostname
+
+
+def percent_encode(
+    s: Union[str, bytes], encode_set: str = 'component'
+) -> Union[str, bytes]:
+    """
+    Returns a copy of *s* with the characters in the given WHATWG
+    `percent-encode set <https://url.spec.whatwg.org/#percent-encoded-bytes>`__
+    replaced by ``%XX`` sequences.
+    Text is UTF-8 encoded first, so non-ASCII characters are always encoded.
+
+    .. code-block:: python
+
+        >>> from ada_url import percent_encode
+        >>> percent_encode('a b/ü')
+        'a%20b%2F%C3%BC'
+        >>> percent_encode(b'a b/c', encode_set='path')
+        b'a%20b/c'
+
+    *encode_set* can be one of ``'c0_control'``, ``'fragment'``, ``'query'``,
+    ``'special_query'``, ``'path'``, ``'userinfo'``, ``'component'``, or
+    ``'form_urlencoded'``.
+
+    The output has the same type as the input (``str`` or ``bytes``).
+    If nothing needs to be encoded, *s* itself is returned.
+    """
+    str_pattern, bytes_pattern, table = _get_percent_encoder(encode_set)
+    if isinstance(s, str):
+        if str_pattern.search(s) is None:
+            return s
+
+        if not s.isascii():
+            s = s.encode().decode('latin-1')
+
+        return s.translate(table)
+
+    if bytes_pattern.search(s) is None:
+        return s
+
+    return str(s, 'latin-1').translate(table).encode('ascii')
+
+
+def percent_decode(s: Union[str, bytes]) -> Union[str, bytes]:
+    """
+    Returns a copy of *s* with ``%XX`` sequences replaced by the bytes they represent.
+    Other ``%`` characters are left alone.
+
+    .. code-block:: python
+
+        >>> from ada_url import percent_decode
+        >>> percent_decode('a%20b%2F%C3%BC%zz')
+        'a b/ü%zz'
+        >>> percent_decode(b'a%20b')
+        b'a b'
+
+    ``str`` input gives ``str`` output, and invalid UTF-8 sequences are replaced
+    with ``U+FFFD``. Other input (``bytes``, ``bytearray``, ``memoryview``, etc.)
+    gives ``bytes`` output.
+    If there is nothing to decode, *s* itself is returned.
+    """
+    if isinstance(s, str):
+        if '%' not in s:
+            return s
+
+        return _PERCENT_DECODE_RE.sub(_percent_decode_match, s.encode()).decode(
+            'utf-8', 'replace'
+        )
+
+    if _PERCENT_DECODE_RE.search(s) is None:
+        return s
+
+    return _PERCENT_DECODE_RE.sub(_percent_decode_match, s)
+
+
+def percent_encode_many(
+    items: Iterable[Union[str, bytes]], encode_set: str = 'component'
+) -> List[Union[str, bytes]]:
+    """
+    Returns a list with the result of calling :func:`percent_encode` on each of
+    the *items*.
+    """
+    str_pattern, bytes_pattern, table = _get_percent_encoder(encode_set)
+    str_search = str_pattern.search
+    bytes_search = bytes_pattern.search
+
+    ret = []
+    for s in items:
+        if isinstance(s, str):
+            if str_search(s) is not None:
+                if not s.isascii():
+                    s = s.encode().decode('latin-1')
+                s = s.translate(table)
+        elif bytes_search(s) is not None:
+            s = str(s, 'latin-1').translate(table).encode('ascii')
+
+        ret.append(s)
+
+    return ret
+
+
+def percent_decode_many(
+    items: Iterable[Union[str, bytes]],
+) -> List[Union[str, bytes]]:
+    """
+    Returns a list with the result of calling :func:`percent_decode` on each of
+    the *items*.
+    """
+    return list(map(percent_decode, items))
+
+
+@lru_cache(maxsize=None)
+def _get_percent_encoder(
+    encode_set: str,
+) -> Tuple[re.Pattern, re.Pattern, List[str]]:
+    # Returns str and bytes patterns that find characters that need encoding,
+    # and a str.translate table that encodes them. Non-ASCII text is translated
+    # after being converted to UTF-8 bytes and back with latin-1, so the table
+    # only needs to cover code points below 256.
+    try:
+        chars = PERCENT_ENCODE_SETS[encode_set]
+    except KeyError:
+        raise ValueError(f'Unknown percent-encode set: {encode_set}') from None
+
+    escaped = re.escape(chars.decode('ascii'))
+    str_pattern = re.compile(f'[\\x00-\\x1f\\x7f-\\U0010ffff{escaped}]')
+    bytes_pattern = re.compile(f'[\\x00-\\x1f\\x7f-\\xff{escaped}]'.encode('ascii'))
+    table = [
+        f'%{i:02X}' if ((i < 0x20) or (i > 0x7E) or (i in chars)) else chr(i)
+        for i in range(256)
+    ]
+    return str_pattern, bytes_pattern, table
+
+
+def _percent_decode_match(match: re.Match) -> bytes:
+    return bytes.fromhex(match.group().decode('ascii').replace('%', ''))
+
+
 class idna:
     """Process international domains according to the UTS #46 standard.
 
@@ -735,6 +3165,16 @@ class idna:
         'meßagefactory.ca'
 
     Both functions accept either ``str`` or ``bytes`` objects as input.
+
+    :func:`idna.encode_many` and :func:`idna.decode_many` convert a batch of inputs
+    and return a list. Pass an :class:`IDNACache` as *cache* to skip converting
+    domains that have been seen before.
+
+    .. code-block:: python
+
+        >>> from ada_url import idna
+        >>> idna.encode_many(['meßagefactory.ca', 'example.org'])
+        [b'xn--meagefactory-m9a.ca', b'example.org']
     """
 
     @staticmethod
@@ -753,11 +3193,1324 @@ class idna:
         val = _get_obj(lib.ada_idna_to_ascii, lib.ada_free_owned_string, s, len(s))
         return ffi.string(val.data, val.length) if val.length else b''
 
+    @staticmethod
+    def decode_many(
+        items: Iterable[Union[str, bytes]], cache: Optional['IDNACache'] = None
+    ) -> List[str]:
+        if cache is not None:
+            return list(map(cache.decode, items))
+
+        to_unicode = lib.ada_idna_to_unicode
+        free = lib.ada_free_owned_string
+        ret = []
+        for s in items:
+            if isinstance(s, str):
+                s = s.encode('ascii')
+
+            data = to_unicode(s, len(s))
+            ret.append(_get_str(data))
+            free(data)
+
+        return ret
+
+    @staticmethod
+    def encode_many(
+        items: Iterable[Union[str, bytes]], cache: Optional['IDNACache'] = None
+    ) -> List[bytes]:
+        if cache is not None:
+            return list(map(cache.encode, items))
+
+        to_ascii = lib.ada_idna_to_ascii
+        free = lib.ada_free_owned_string
+        ret = []
+        for s in items:
+            if isinstance(s, str):
+                s = s.encode()
+
+            val = to_ascii(s, len(s))
+            ret.append(ffi.unpack(val.data, val.length) if val.length else b'')
+            free(val)
+
+        return ret
+
+
+class IDNACache:
+    """
+    A bounded cache for :class:`idna` conversions. Domains that have been seen
+    recently are returned without repeating the UTS #46 processing.
+
+    .. code-block:: python
+
+        >>> from ada_url import IDNACache, idna
+        >>> cache = IDNACache(maxsize=1024)
+        >>> idna.encode_many(['Bücher.example', 'Bücher.example'], cache=cache)
+        [b'xn--bcher-kva.example', b'xn--bcher-kva.example']
+        >>> cache.cache_info()['encode']
+        CacheInfo(hits=1, misses=1, maxsize=1024, currsize=1)
+
+    Once *maxsize* distinct inputs have been cached, the least recently used
+    ones are discarded.
+    ``encode`` and ``decode`` have the same interface as their :class:`idna`
+    counterparts.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.encode = lru_cache(maxsize=maxsize)(idna.encode)
+        self.decode = lru_cache(maxsize=maxsize)(idna.decode)
+
+    def encode_many(self, items: Iterable[Union[str, bytes]]) -> List[bytes]:
+        return idna.encode_many(items, cache=self)
+
+    def decode_many(self, items: Iterable[Union[str, bytes]]) -> List[str]:
+        return idna.decode_many(items, cache=self)
+
+    def cache_info(self) -> Dict[str, Any]:
+        return {
+            'encode': self.encode.cache_info(),
+            'decode': self.decode.cache_info(),
+        }
+
+    def cache_clear(self):
+        self.encode.cache_clear()
+        self.decode.cache_clear()
+
+
+# The components that InternTable shares by default, which usually have far
+# fewer distinct values than there are URLs.
+INTERNED_ATTRIBUTES = ('protocol', 'host', 'hostname', 'port', 'origin')
+
+
+class InternTable:
+    """
+    A bounded table of shared strings for URL components. Functions that accept
+    one as *intern* return the same ``str`` object for each occurrence of a
+    component value, rather than a new one each time.
+
+    .. code-block:: python
+
+        >>> from ada_url import InternTable, parse_url
+        >>> table = InternTable()
+        >>> a = parse_url('https://example.org/a', intern=table)
+        >>> b = parse_url('https://example.org/b', intern=table)
+        >>> a['hostname'] is b['hostname']
+        True
+
+    This saves memory when many parsed URLs are kept, and makes comparing and
+    grouping by the shared components quicker.
+
+    Only the components named in *attributes* are shared. Once *maxsize*
+    distinct values have been stored, new values are returned without being
+    stored. A table can be used for a single batch or kept for a session.
+    """
+
+    def __init__(
+        self, attributes: Iterable[str] = INTERNED_ATTRIBUTES, maxsize: int = 65536
+    ):
+        self.attributes = frozenset(attributes)
+        for attr in self.attributes:
+            if attr not in URL_ATTRIBUTES and attr != 'origin':
+                raise ValueError(f'Unknown attribute: {attr}')
+
+        self.maxsize = maxsize
+        self._strings = {}
+
+    def __repr__(self):
+        return f'<InternTable len={len(self)} maxsize={self.maxsize}>'
+
+    def __len__(self) -> int:
+        return len(self._strings)
+
+    def __contains__(self, value: Union[str, bytes]) -> bool:
+        if isinstance(value, str):
+            value = value.encode()
+
+        return value in self._strings
+
+    def intern(self, value: Union[str, bytes]) -> str:
+        """
+        Returns the stored string that is equal to *value*, storing it if there
+        is room.
+        """
+        if isinstance(value, str):
+            value = value.encode()
+
+        return self._get(value)
+
+    def clear(self):
+        self._strings.clear()
+
+    def _get(self, value: bytes) -> str:
+        # Returns the shared str for the UTF-8 encoded value
+        ret = self._strings.get(value)
+        if ret is None:
+            ret = str(value, 'utf-8')
+            if len(self._strings) < self.maxsize:
+                self._strings[value] = ret
+
+        return ret
+
 
 idna_to_unicode = idna.decode
 
 idna_to_ascii = idna.encode
 
 
+class PublicSuffixList:
+    """
+    A compiled copy of the `Public Suffix List <https://publicsuffix.org/>`__,
+    used to find the public suffix and registrable domain ("eTLD+1") of a host.
+
+    .. code-block:: python
+
+        >>> from ada_url import PublicSuffixList
+        >>> psl = PublicSuffixList.default()
+        >>> psl.public_suffix('www.example.co.uk')
+        'co.uk'
+        >>> psl.registrable_domain('www.example.co.uk')
+        'example.co.uk'
+        >>> psl.registrable_domains(['https://a.b.example.com/', 'http://[::1]/'])
+        ['example.com', None]
+
+    :meth:`default` returns a shared instance built from the snapshot that is
+    bundled with this package.
+    Use :meth:`from_file` to load an updated copy of the list instead.
+    Set *private* to ``False`` to ignore the list's "private domains" section.
+
+    ``None`` is returned for IP addresses, empty hosts, and hosts that are
+    themselves public suffixes (for :meth:`registrable_domain`).
+    Hosts are expected to be in the ASCII form that :class:`URL` produces.
+    """
+
+    def __init__(self, data: str, private: bool = True):
+        self.rules = set()
+        self.wildcards = set()
+        self.exceptions = set()
+
+        for line in data.splitlines():
+            if (not private) and ('===BEGIN PRIVATE DOMAINS===' in line):
+                break
+
+            rule = line.strip().split(' ', 1)[0]
+            if (not rule) or rule.startswith('//'):
+                continue
+
+            if rule.startswith('!'):
+                self.exceptions.add(_psl_rule_to_ascii(rule[1:]))
+            elif rule.startswith('*.'):
+                self.wildcards.add(_psl_rule_to_ascii(rule[2:]))
+            else:
+                self.rules.add(_psl_rule_to_ascii(rule))
+
+    @classmethod
+    def from_file(cls, path: str, private: bool = True) -> 'PublicSuffixList':
+        with open(path, 'rt', encoding='utf-8') as f:
+            return cls(f.read(), private=private)
+
+    @classmethod
+    @lru_cache(maxsize=1)
+    def default(cls) -> 'PublicSuffixList':
+        return cls.from_file(PUBLIC_SUFFIX_LIST_PATH)
+
+    def public_suffix(self, hostname: str) -> Optional[str]:
+        split = self._split(hostname)
+        return None if split is None else split[0]
+
+    def registrable_domain(self, hostname: str) -> Optional[str]:
+        split = self._split(hostname)
+        return None if split is None else split[1]
+
+    def registrable_domains(
+        self, urls: Iterable[str], intern: Optional[InternTable] = None
+    ) -> List[Optional[str]]:
+        """
+        Return the registrable domain of the host of each of the given *urls*.
+        Invalid URLs raise ``ValueError``.
+
+        Pass an :class:`InternTable` as *intern* to share the strings for
+        repeated domains.
+        """
+        split = self._split
+        ret = []
+        for s in urls:
+            try:
+                s_bytes = s.encode()
+            except Exception:
+                raise ValueError('Invalid URL') from None
+
+            urlobj = lib.ada_parse(s_bytes, len(s_bytes))
+            try:
+                if not lib.ada_is_valid(urlobj):
+                    raise ValueError('Invalid URL') from None
+
+                if lib.ada_get_host_type(urlobj) != HostType.DEFAULT:
+                    ret.append(None)
+                    continue
+
+                hostname = _get_str(lib.ada_get_hostname(urlobj))
+            finally:
+                lib.ada_free(urlobj)
+
+            result = split(hostname)
+            if (result is None) or (result[1] is None):
+                ret.append(None)
+            elif intern is None:
+                ret.append(result[1])
+            else:
+                ret.append(intern.intern(result[1]))
+
+        return ret
+
+    def _split(self, hostname: str) -> Optional[Tuple[str, Optional[str]]]:
+        # Returns the (public suffix, registrable domain) pair for hostname
+        trailing_dot = hostname.endswith('.')
+        if trailing_dot:
+            hostname = hostname[:-1]
+
+        labels = hostname.split('.')
+        if (not hostname) or ('' in labels) or _is_ip_hostname(labels):
+            return None
+
+        rules = self.rules
+        wildcards = self.wildcards
+        exceptions = self.exceptions
+
+        # Check the longest candidate suffixes first; the first rule that
+        # matches is the prevailing one. No match means the implicit "*" rule.
+        label_count = len(labels)
+        suffix_start = label_count - 1
+        for i in range(label_count):
+            candidate = '.'.join(labels[i:])
+            if candidate in exceptions:
+                suffix_start = i + 1
+                break
+            if (candidate in rules) or (
+                (i + 1 < label_count) and ('.'.join(labels[i + 1 :]) in wildcards)
+            ):
+                suffix_start = i
+                break
+
+        dot = '.' if trailing_dot else ''
+        public_suffix = '.'.join(labels[suffix_start:]) + dot
+        if suffix_start == 0:
+            return public_suffix, None
+
+        return public_suffix, '.'.join(labels[suffix_start - 1 :]) + dot
+
+
+def _psl_rule_to_ascii(rule: str) -> str:
+    if rule.isascii():
+        return rule.lower()
+
+    return idna.encode(rule).decode()
+
+
+def _is_ip_hostname(labels: List[str]) -> bool:
+    # IPv6 hosts are bracketed, and hosts that end in a number are IPv4
+    # addresses (see https://url.spec.whatwg.org/#ends-in-a-number-checker)
+    if labels[0].startswith('['):
+        return True
+
+    return _IPV4_NUMBER_RE.match(labels[-1]) is not None
+
+
+class _RobotsNode:
+    # A node in a RobotsRules trie. The (length, allow) values of the patterns
+    # that end here are in prefix (for patterns that match any continuation)
+    # and anchored (for patterns that end in "$").
+    __slots__ = ('children', 'star', 'prefix', 'anchored')
+
+    def __init__(self):
+        self.children = {}
+        self.star = None
+        self.prefix = None
+        self.anchored = None
+
+
+class RobotsRules:
+    """
+    A compiled copy of the rules in a
+    `robots.txt <https://www.rfc-editor.org/rfc/rfc9309>`__ file, used to check
+    whether crawlers may fetch URLs.
+
+    .. code-block:: python
+
+        >>> from ada_url import RobotsRules
+        >>> robots = RobotsRules(
+        ...     'User-agent: *\\n'
+        ...     'Disallow: /private\\n'
+        ...     'Allow: /private/*.html$\\n'
+        ... )
+        >>> robots.allowed('https://example.org/private/a.html')
+        True
+        >>> robots.allowed('https://example.org/private/a.html?x=1')
+        False
+        >>> robots.allowed_many(['https://example.org/', 'https://example.org/private'])
+        [True, False]
+
+    *data* is the body of the file, as ``str`` or UTF-8 ``bytes``.
+    Rules are matched against the path and query of each URL. As in RFC 9309,
+    ``*`` in a rule matches any sequence of characters and a trailing ``$``
+    anchors it to the end, the longest matching rule applies, and ``Allow``
+    wins ties. URLs that no rule matches are allowed.
+
+    *agent* selects the group of rules by product token, case-insensitively
+    (so ``'MyBot/1.0'`` selects the ``User-agent: mybot`` group). The ``*``
+    group applies to agents that don't have their own.
+
+    The rules for each group are compiled into a trie, so checking a URL takes
+    time proportional to the length of its path rather than the number of rules.
+    Invalid URLs raise ``ValueError``.
+    """
+
+    def __init__(self, data: Union[str, bytes]):
+        if isinstance(data, (bytes, bytearray)):
+            data = bytes(data).decode('utf-8', errors='replace')
+
+        self.groups = {}
+        agents = []
+        in_rules = False
+        for line in data.splitlines():
+            key, sep, value = line.split('#', 1)[0].partition(':')
+            if not sep:
+                continue
+
+            key = key.strip().lower()
+            value = value.strip()
+            if key == 'user-agent':
+                # Consecutive user-agent lines share the rules that follow them
+                if in_rules:
+                    agents = []
+                    in_rules = False
+                token = _get_robots_product_token(value)
+                if token is not None:
+                    agents.append(token)
+            elif key in ('allow', 'disallow'):
+                in_rules = True
+                if not value:
+                    continue
+                for token in agents:
+                    root = self.groups.get(token)
+                    if root is None:
+                        root = self.groups[token] = _RobotsNode()
+                    _add_robots_rule(root, value, key == 'allow')
+
+    def allowed(self, url: Union['URL', str], agent: str = '*') -> bool:
+        """
+        Returns ``True`` if *agent* may fetch *url* (a URL object or string).
+        """
+        root = self._get_root(agent)
+        if isinstance(url, URL):
+            return _match_robots_rules(root, _get_robots_path(url.urlobj))
+
+        try:
+            url_bytes = url.encode()
+        except Exception:
+            raise ValueError('Invalid URL') from None
+
+        urlobj = lib.ada_parse(url_bytes, len(url_bytes))
+        try:
+            if not lib.ada_is_valid(urlobj):
+                raise ValueError('Invalid URL')
+
+            return _match_robots_rules(root, _get_robots_path(urlobj))
+        finally:
+            lib.ada_free(urlobj)
+
+    def allowed_many(self, urls: Iterable[str], agent: str = '*') -> List[bool]:
+        """
+        Returns ``True`` or ``False`` for each of the given *urls*, as with
+        :meth:`allowed`.
+        """
+        root = self._get_root(agent)
+        parse = lib.ada_parse
+        is_valid = lib.ada_is_valid
+        free = lib.ada_free
+        ret = []
+        for s in urls:
+            try:
+                s_bytes = s.encode()
+            except Exception:
+                raise ValueError('Invalid URL') from None
+
+            urlobj = parse(s_bytes, len(s_bytes))
+            try:
+                if not is_valid(urlobj):
+                    raise ValueError('Invalid URL')
+
+                ret.append(_match_robots_rules(root, _get_robots_path(urlobj)))
+            finally:
+                free(urlobj)
+
+        return ret
+
+    def _get_root(self, agent: str) -> Optional[_RobotsNode]:
+        token = _get_robots_product_token(agent)
+        root = self.groups.get(token)
+        if root is None:
+            root = self.groups.get('*')
+
+        return root
+
+
+def _get_robots_product_token(agent: str) -> Optional[str]:
+    match = _ROBOTS_PRODUCT_TOKEN_RE.match(agent)
+    return None if match is None else match.group(1).lower()
+
+
+def _normalize_robots_escape(match: re.Match) -> bytes:
+    hex_digits = match.group(1)
+    if hex_digits is None:
+        return b'%%%02X' % ord(match.group())
+
+    value = int(hex_digits, 16)
+    if value in _ROBOTS_UNRESERVED:
+        return bytes((value,))
+
+    return b'%' + hex_digits.upper()
+
+
+def _normalize_robots_path(path: bytes) -> bytes:
+    # Makes equivalent paths (e.g. "/%7Ea" and "/~a") compare equal
+    if _ROBOTS_UNSAFE_RE.search(path) is None:
+        return path
+
+    return _ROBOTS_ESCAPE_RE.sub(_normalize_robots_escape, path)
+
+
+def _add_robots_rule(root: _RobotsNode, pattern: str, allow: bool):
+    pattern_bytes = pattern.encode()
+    # Longer patterns (in octets) take precedence, then Allow over Disallow
+    value = (len(pattern_bytes), allow)
+    if not pattern_bytes.startswith((b'/', b'*')):
+        pattern_bytes = b'/' + pattern_bytes
+
+    anchored = pattern_bytes.endswith(b'$')
+    if anchored:
+        pattern_bytes = pattern_bytes[:-1]
+
+    node = root
+    at_star = False
+    for i, piece in enumerate(pattern_bytes.split(b'*')):
+        # Consecutive wildcards are the same as one, so the empty pieces
+        # between them don't add another wildcard node
+        if i and (not at_star):
+            if node.star is None:
+                node.star = _RobotsNode()
+            node = node.star
+            at_star = True
+        if piece:
+            at_star = False
+        for byte in _normalize_robots_path(piece):
+            child = node.children.get(byte)
+            if child is None:
+                child = node.children[byte] = _RobotsNode()
+            node = child
+
+    if anchored:
+        node.anchored = value if node.anchored is None else max(node.anchored, value)
+    else:
+        node.prefix = value if node.prefix is None else max(node.prefix, value)
+
+
+def _get_robots_path(urlobj) -> bytes:
+    # Returns the path and query of the URL, which are adjacent in its href
+    href = lib.ada_get_href(urlobj)
+    components = lib.ada_get_components(urlobj)
+    start = components.pathname_start
+    end = components.hash_start
+    if end == URL_OMITTED:
+        end = href.length
+    if end <= start:
+        return b'/'
+
+    return _normalize_robots_path(ffi.unpack(href.data + start, end - start))
+
+
+def _match_robots_rules(root: Optional[_RobotsNode], path: bytes) -> bool:
+    if (root is None) or (path == b'/robots.txt'):
+        return True
+
+    # This runs the trie as an automaton over the path. Wildcard nodes stay
+    # active once they're reached, since they match any sequence. Each literal
+    # node has one parent, so neither list of active nodes has duplicates.
+    best = (-1, True)
+    stars = []
+    entered = [root]
+    length = len(path)
+    position = 0
+    while True:
+        for node in entered:
+            value = node.prefix
+            if (value is not None) and (value > best):
+                best = value
+            star = node.star
+            if (star is not None) and (star not in stars):
+                stars.append(star)
+                value = star.prefix
+                if (value is not None) and (value > best):
+                    best = value
+
+        literals = entered
+        if (position == length) or not (literals or stars):
+            break
+
+        byte = path[position]
+        position += 1
+        entered = []
+        for node in literals:
+            child = node.children.get(byte)
+            if child is not None:
+                entered.append(child)
+        for node in stars:
+            child = node.children.get(byte)
+            if child is not None:
+                entered.append(child)
+
+    if position == length:
+        for node in literals + stars:
+            value = node.anchored
+            if (value is not None) and (value > best):
+                best = value
+
+    return best[1]
+
+
+class ComponentAggregator:
+    """
+    Counts the values of one component of a stream of URLs, using a bounded
+    amount of memory.
+
+    .. code-block:: python
+
+        >>> from ada_url import ComponentAggregator
+        >>> hosts = ComponentAggregator('hostname', limit=1000)
+        >>> hosts.update(['https://example.org/a', 'https://example.org/b'])
+        >>> hosts.add('https://example.com/')
+        >>> hosts.most_common(1)
+        [('example.org', 2)]
+
+    *attribute* can be any of the :class:`URL` components (e.g. ``host``,
+    ``pathname``), or ``origin``. Invalid URLs are not counted, but
+    the number of them is kept in the ``invalid`` attribute. The number of
+    valid ones is kept in the ``total`` attribute.
+
+    Counts are exact until *limit* distinct values have been seen. After that,
+    the `Space-Saving <https://doi.org/10.1007/978-3-540-30570-5_27>`__
+    algorithm is used: each new value replaces the one with the smallest count,
+    and takes over its count. Counts are then upper bounds, which exceed the
+    true count by at most :meth:`error`, and any value that occurs more than
+    ``total / limit`` times is sure to be kept.
+
+    Aggregators for the same *attribute* can be combined with :meth:`merge`,
+    and can be pickled, so that counting can be split across processes.
+
+    Values are kept as the ``bytes`` returned by Ada, and are only converted
+    to ``str`` when results are requested.
+    """
+
+    def __init__(self, attribute: str = 'host', limit: int = 100_000):
+        if (attribute not in URL_ATTRIBUTES) and (attribute != 'origin'):
+            raise ValueError(f'Unknown attribute: {attribute}')
+        if limit < 1:
+            raise ValueError('limit must be at least 1')
+
+        self.attribute = attribute
+        self.limit = limit
+        self.total = 0
+        self.invalid = 0
+        self._counts = {}
+        # Over-estimates for the values that have them
+        self._errors = {}
+        # The most that a value that's not being tracked could have occurred
+        self._floor = 0
+        # Maps counts to the values that have them, once values are replaced
+        self._buckets = None
+        self._min_count = 0
+
+    def __repr__(self):
+        return (
+            f'<ComponentAggregator "{self.attribute}" '
+            f'total={self.total} tracked={len(self._counts)}>'
+        )
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def __contains__(self, value: str) -> bool:
+        return value.encode() in self._counts
+
+    def __getitem__(self, value: str) -> int:
+        return self._counts.get(value.encode(), 0)
+
+    @property
+    def exact(self) -> bool:
+        """
+        ``True`` if the counts are exact, and ``False`` if some values have been
+        replaced.
+        """
+        return not self._floor
+
+    def add(self, url: str):
+        """
+        Counts the component of *url*.
+        """
+        self.update((url,))
+
+    def update(self, urls: Iterable[str]):
+        """
+        Counts the component of each of the given *urls*.
+        """
+        parse = lib.ada_parse
+        is_valid = lib.ada_is_valid
+        free = lib.ada_free
+        unpack = ffi.unpack
+        is_origin = self.attribute == 'origin'
+        if not is_origin:
+            getter = getattr(lib, f'ada_get_{self.attribute}')
+        counts = self._counts
+        total = invalid = 0
+        try:
+            for s in urls:
+                try:
+                    s_bytes = s.encode()
+                except Exception:
+                    invalid += 1
+                    continue
+
+                urlobj = parse(s_bytes, len(s_bytes))
+                try:
+                    if not is_valid(urlobj):
+                        invalid += 1
+                        continue
+
+                    if is_origin:
+                        origin = lib.ada_get_origin(urlobj)
+                        key = unpack(origin.data, origin.length)
+                        lib.ada_free_owned_string(origin)
+                    else:
+                        value = getter(urlobj)
+                        key = unpack(value.data, value.length)
+                finally:
+                    free(urlobj)
+
+                total += 1
+                count = counts.get(key)
+                if (count is not None) and (self._buckets is None):
+                    counts[key] = count + 1
+                else:
+                    self._count(key, count)
+        finally:
+            self.total += total
+            self.invalid += invalid
+
+    def _count(self, key: bytes, count: Optional[int]):
+        counts = self._counts
+        buckets = self._buckets
+        if buckets is None:
+            if len(counts) < self.limit:
+                counts[key] = self._floor + 1
+                if self._floor:
+                    self._errors[key] = self._floor
+                return
+
+            buckets = self._buckets = {}
+            for other_key, other_count in counts.items():
+                buckets.setdefault(other_count, set()).add(other_key)
+            self._min_count = min(buckets)
+
+        if count is None:
+            # Replace one of the values with the smallest count
+            count = self._min_count
+            bucket = buckets[count]
+            replaced = bucket.pop()
+            del counts[replaced]
+            self._errors.pop(replaced, None)
+            self._errors[key] = count
+            self._floor = count
+        else:
+            bucket = buckets[count]
+            bucket.remove(key)
+
+        if not bucket:
+            del buckets[count]
+            if count == self._min_count:
+                self._min_count = count + 1
+
+        counts[key] = count + 1
+        buckets.setdefault(count + 1, set()).add(key)
+
+    def error(self, value: str) -> int:
+        """
+        Returns the most that the count for *value* could exceed its true count
+        by. This is ``0`` while the counts are exact.
+
+        For values that aren't being tracked, this is the most that they could
+        have occurred.
+        """
+        key = value.encode()
+        if key in self._counts:
+            return self._errors.get(key, 0)
+
+        return self._floor
+
+    def most_common(self, n: Optional[int] = None) -> List[Tuple[str, int]]:
+        """
+        Returns a list of the *n* most common values and their counts, from the
+        most common to the least. If *n* is ``None``, all of the tracked values
+        are listed.
+        """
+        items = sorted(self._counts.items(), key=lambda item: item[1], reverse=True)
+        if n is not None:
+            items = items[:n]
+
+        return [(key.decode(), count) for key, count in items]
+
+    def merge(self, other: 'ComponentAggregator'):
+        """
+        Adds the counts from *other*, which must count the same attribute.
+
+        If the two together track more than *limit* values, the ones with the
+        largest counts are kept.
+        """
+        if other.attribute != self.attribute:
+            raise ValueError('Aggregators must count the same attribute')
+
+        # A value that's missing from one side could have occurred as many
+        # times as that side's floor, so that's added to its count and error.
+        self_floor = self._floor
+        other_floor = other._floor
+        counts = {}
+        errors = {}
+        for key in self._counts.keys() | other._counts.keys():
+            counts[key] = self._counts.get(key, self_floor) + other._counts.get(
+                key, other_floor
+            )
+            error = self._errors.get(key, 0) if key in self._counts else self_floor
+            if key in other._counts:
+                error += other._errors.get(key, 0)
+            else:
+                error += other_floor
+            if error:
+                errors[key] = error
+
+        floor = self_floor + other_floor
+        if len(counts) > self.limit:
+            ranked = sorted(counts, key=counts.__getitem__, reverse=True)
+            for key in ranked[self.limit :]:
+                floor = max(floor, counts.pop(key))
+                errors.pop(key, None)
+
+        self._counts = counts
+        self._errors = errors
+        self._floor = floor
+        self._buckets = None
+        self.total += other.total
+        self.invalid += other.invalid
+
+
+class _StoredComponents(NamedTuple):
+    # The subset of ada_url_components that _get_spans uses
+    protocol_end: int
+    username_end: int
+    host_start: int
+    host_end: int
+    port: int
+    pathname_start: int
+    search_start: int
+    hash_start: int
+
+
+class _URLTable:
+    # The read-only parts of URLStore and URLIndex. Subclasses set _data,
+    # _starts, _components, and _flags, which can be arrays or memoryviews.
+
+    # protocol_end, username_end, host_start, host_end, pathname_start,
+    # search_start, and hash_start. Absent search and hash components are
+    # stored as empty ones at the position where they would start.
+    _COMPONENT_COUNT = 7
+
+    def __len__(self) -> int:
+        return len(self._flags)
+
+    def __getitem__(self, index: int) -> 'URLView':
+        return URLView(self, self._check_index(index))
+
+    def __iter__(self) -> Iterator['URLView']:
+        for index in range(len(self)):
+            yield URLView(self, index)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The number of bytes used by the URL data and offset tables.
+        """
+        return sum(
+            len(buffer) * buffer.itemsize
+            for buffer in (self._starts, self._components, self._flags)
+        ) + len(self._data)
+
+    def get(
+        self,
+        index: int,
+        attribute: str,
+        *,
+        intern: Optional[InternTable] = None,
+    ) -> Union[str, HostType, SchemeType]:
+        """
+        Returns the *attribute* component of the URL at *index*. *attribute*
+        can be any of the :class:`URL` attributes that can be read.
+
+        Pass an :class:`InternTable` as *intern* to share the strings for
+        repeated components.
+        """
+        index = self._check_index(index)
+        if attribute == 'host_type':
+            return HostType((self._flags[index] >> 3) & 0b11)
+        if attribute == 'scheme_type':
+            return SchemeType(self._flags[index] & 0b111)
+
+        href = self._data[self._starts[index] : self._starts[index + 1]]
+        if attribute == 'href':
+            return str(href, 'utf-8')
+        if attribute == 'origin':
+            # This is computed by Ada to handle blob: and other special cases
+            return parse_url(str(href, 'utf-8'), attributes=('origin',), intern=intern)[
+                'origin'
+            ]
+
+        try:
+            span_index = _SPAN_INDEXES[attribute]
+        except KeyError:
+            raise AttributeError(f'no attribute named {attribute}') from None
+
+        first = index * self._COMPONENT_COUNT
+        (
+            protocol_end,
+            username_end,
+            host_start,
+            host_end,
+            pathname_start,
+            search_start,
+            hash_start,
+        ) = self._components[first : first + self._COMPONENT_COUNT]
+        components = _StoredComponents(
+            protocol_end,
+            username_end,
+            host_start,
+            host_end,
+            0 if (self._flags[index] & 0b100000) else URL_OMITTED,
+            pathname_start,
+            search_start,
+            hash_start,
+        )
+        start, end = _get_spans(href, components)[span_index]
+        if (intern is not None) and (attribute in intern.attributes):
+            return intern._get(bytes(href[start:end]))
+
+        return str(href[start:end], 'utf-8')
+
+    def _check_index(self, index: int) -> int:
+        length = len(self)
+        if index < 0:
+            index += length
+        if not (0 <= index < length):
+            raise IndexError('index out of range')
+
+        return index
+
+
+class URLStore(_URLTable):
+    """
+    Stores many parsed URLs compactly. The normalized hrefs are kept in one
+    ``bytearray``, and the positions of their components are kept in arrays,
+    which takes about 23 bytes per URL in addition to the href itself.
+
+    .. code-block:: python
+
+        >>> from ada_url import URLStore
+        >>> store = URLStore()
+        >>> store.append('https://example.org/a?b')
+        0
+        >>> store.extend(['https://example.com:8080/', 'file:///tmp/x'])
+        >>> len(store)
+        3
+        >>> store.get(1, 'port')
+        '8080'
+        >>> view = store[0]
+        >>> view.hostname, view.search
+        ('example.org', '?b')
+
+    ``ValueError`` is raised if an invalid URL is added. When that happens
+    with :meth:`extend`, the URLs before the invalid one remain in the store.
+
+    Indexing the store gives a :class:`URLView`, which reads components from
+    the store when they are accessed. :meth:`get` reads a single component
+    without creating a view.
+    """
+
+    def __init__(self, urls: Iterable[str] = ()):
+        self._data = bytearray()
+        # The starting position of each href in _data, plus the end of the last
+        self._starts = array('Q', [0])
+        # Seven offsets into each href; see _COMPONENT_COUNT
+        self._components = array('H')
+        # scheme_type in bits 0-2, host_type in bits 3-4, and whether there's a
+        # port in bit 5
+        self._flags = array('B')
+        self.extend(urls)
+
+    def __repr__(self):
+        return f'<URLStore len={len(self)}>'
+
+    def append(self, url: str) -> int:
+        """
+        Parses *url*, adds it to the store, and returns its index.
+        """
+        self.extend((url,))
+        return len(self) - 1
+
+    def extend(self, urls: Iterable[str]):
+        """
+        Parses each of the *urls* and adds them to the store.
+        """
+        parse = lib.ada_parse
+        is_valid = lib.ada_is_valid
+        free = lib.ada_free
+        get_href = lib.ada_get_href
+        get_components = lib.ada_get_components
+        get_host_type = lib.ada_get_host_type
+        get_scheme_type = lib.ada_get_scheme_type
+        data = self._data
+        starts = self._starts
+        offsets = self._components
+        flags = self._flags
+        for s in urls:
+            try:
+                s_bytes = s.encode()
+            except Exception:
+                raise ValueError('Invalid URL') from None
+
+            urlobj = parse(s_bytes, len(s_bytes))
+            try:
+                if not is_valid(urlobj):
+                    raise ValueError('Invalid URL') from None
+
+                href = get_href(urlobj)
+                length = href.length
+                if (length > 0xFFFF) and (offsets.typecode == 'H'):
+                    offsets = self._components = array('I', offsets)
+
+                components = get_components(urlobj)
+                hash_start = components.hash_start
+                if hash_start == URL_OMITTED:
+                    hash_start = length
+                search_start = components.search_start
+                if search_start == URL_OMITTED:
+                    search_start = hash_start
+                offsets.extend(
+                    (
+                        components.protocol_end,
+                        components.username_end,
+                        components.host_start,
+                        components.host_end,
+                        components.pathname_start,
+                        search_start,
+                        hash_start,
+                    )
+                )
+                flags.append(
+                    get_scheme_type(urlobj)
+                    | (get_host_type(urlobj) << 3)
+                    | ((components.port != URL_OMITTED) << 5)
+                )
+                data += ffi.buffer(href.data, length)
+                starts.append(len(data))
+            finally:
+                free(urlobj)
+
+
+class URLView:
+    """
+    A read-only view of one of the URLs in a :class:`URLStore`. It has the same
+    attributes as :class:`URL`, which are read from the store when accessed.
+
+    Call :meth:`to_url` to get a :class:`URL` object that can be modified.
+    """
+
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store: URLStore, index: int):
+        self._store = store
+        self._index = index
+
+    def __dir__(self) -> List[str]:
+        return super().__dir__() + list(PARSE_ATTRIBUTES)
+
+    def __getattr__(self, attr: str) -> Union[str, HostType, SchemeType]:
+        if attr in GET_ATTRIBUTES:
+            return self._store.get(self._index, attr)
+
+        raise AttributeError(f'no attribute named {attr}')
+
+    def __str__(self):
+        return self.href
+
+    def __repr__(self):
+        return f'<URLView "{self.href}">'
+
+    def to_url(self) -> URL:
+        """
+        Returns a new :class:`URL` object for the URL.
+        """
+        return URL(self.href)
+
+
+class URLIndex(_URLTable):
+    """
+    A read-only :class:`URLStore` that's backed by a memory-mapped file created
+    with :func:`write_index`. Use :func:`open_index` to create one.
+
+    Components are read from the file's pages without parsing or copying, so
+    processes that open the same file share one copy of it in the page cache.
+    Indexing gives :class:`URLView` objects, and :meth:`get` reads a single
+    component, just as with :class:`URLStore`.
+
+    If the file has a hash index, :meth:`find` looks up the position of a URL.
+    ``url in index`` is a shortcut for checking whether it's present.
+
+    Call :meth:`close` (or use the object as a context manager) to unmap the
+    file. Views can't be read after that.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError('Not a URL index') from None
+
+        try:
+            header = _INDEX_HEADER.unpack_from(self._mmap)
+        except struct.error:
+            self._mmap.close()
+            raise ValueError('Not a URL index') from None
+
+        (
+            magic,
+            version,
+            flags,
+            count,
+            data_offset,
+            data_length,
+            starts_offset,
+            components_offset,
+            flags_offset,
+            table_offset,
+            table_size,
+        ) = header
+        error = None
+        if magic != _INDEX_MAGIC:
+            error = 'Not a URL index'
+        elif version != _INDEX_VERSION:
+            error = f'Unsupported URL index version: {version}'
+        elif bool(flags & _INDEX_BIG_ENDIAN) != (sys.byteorder == 'big'):
+            error = 'The URL index was written with a different byte order'
+        if error is not None:
+            self._mmap.close()
+            raise ValueError(error)
+
+        components_format = 'I' if (flags & _INDEX_WIDE_OFFSETS) else 'H'
+        components_end = components_offset + (
+            count * self._COMPONENT_COUNT * struct.calcsize(components_format)
+        )
+        with memoryview(self._mmap) as view:
+            self._data = view[data_offset : data_offset + data_length]
+            self._starts = view[starts_offset : starts_offset + (count + 1) * 8].cast(
+                'Q'
+            )
+            self._components = view[components_offset:components_end].cast(
+                components_format
+            )
+            self._flags = view[flags_offset : flags_offset + count]
+            self._table = None
+            if table_size:
+                self._table = view[table_offset : table_offset + table_size * 4].cast(
+                    'I'
+                )
+
+    def __repr__(self):
+        return f'<URLIndex "{self.path}">'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __contains__(self, url: str) -> bool:
+        return self.find(url) is not None
+
+    def close(self):
+        """
+        Unmaps the index file.
+        """
+        for view in (self._data, self._starts, self._components, self._flags):
+            view.release()
+        if self._table is not None:
+            self._table.release()
+        self._mmap.close()
+
+    def find(self, url: str) -> Optional[int]:
+        """
+        Returns the position of the first occurrence of *url* in the index, or
+        ``None`` if it's not present. *url* is normalized before it's looked up.
+
+        ``ValueError`` is raised if the index was written without a hash index.
+        """
+        if self._table is None:
+            raise ValueError('The URL index has no hash index')
+
+        try:
+            url_bytes = url.encode()
+        except Exception:
+            return None
+
+        urlobj = lib.ada_parse(url_bytes, len(url_bytes))
+        try:
+            if not lib.ada_is_valid(urlobj):
+                return None
+            href = lib.ada_get_href(urlobj)
+            href_bytes = ffi.unpack(href.data, href.length)
+        finally:
+            lib.ada_free(urlobj)
+
+        slot = _probe_hash_table(self._table, self._data, self._starts, href_bytes)
+        position = self._table[slot]
+        return (position - 1) if position else None
+
+
+def write_index(
+    urls: Union[Iterable[str], URLStore], path: str, hash_index: bool = True
+):
+    """
+    Parses each of the *urls* and writes them to the file at *path*, which can
+    be opened with :func:`open_index`. *urls* can also be a :class:`URLStore`.
+
+    .. code-block:: python
+
+        >>> from ada_url import open_index, write_index
+        >>> write_index(['https://example.org/a', 'https://example.com/'], 'urls.idx')
+        >>> with open_index('urls.idx') as index:
+        ...     index.get(1, 'hostname'), index.find('HTTPS://EXAMPLE.ORG/a')
+        ('example.com', 0)
+
+    If *hash_index* is ``True``, a hash table that maps normalized hrefs to their
+    positions is included, which :meth:`URLIndex.find` uses.
+
+    ``ValueError`` is raised if one of the *urls* is invalid. The file is written
+    to a temporary path and then moved to *path*, so processes that have the
+    old file open are not affected.
+
+    The file starts with a header that records the format version, followed
+    by the hrefs and the :class:`URLStore` offset tables. The tables use the
+    byte order of the machine that wrote them.
+    """
+    store = urls if isinstance(urls, URLStore) else URLStore(urls)
+    table = _build_hash_table(store) if hash_index else array('I')
+
+    flags = 0
+    if store._components.typecode == 'I':
+        flags |= _INDEX_WIDE_OFFSETS
+    if sys.byteorder == 'big':
+        flags |= _INDEX_BIG_ENDIAN
+
+    tmp_path = f'{os.fspath(path)}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(bytes(_INDEX_HEADER.size))
+        offsets = []
+        for buffer in (
+            store._data,
+            store._starts,
+            store._components,
+            store._flags,
+            table,
+        ):
+            f.write(bytes(-f.tell() % 8))
+            offsets.append(f.tell())
+            f.write(buffer)
+
+        data_offset, starts_offset, components_offset, flags_offset, table_offset = (
+            offsets
+        )
+        f.seek(0)
+        f.write(
+            _INDEX_HEADER.pack(
+                _INDEX_MAGIC,
+                _INDEX_VERSION,
+                flags,
+                len(store),
+                data_offset,
+                len(store._data),
+                starts_offset,
+                components_offset,
+                flags_offset,
+                table_offset,
+                len(table),
+            )
+        )
+
+    os.replace(tmp_path, path)
+
+
+def open_index(path: str) -> URLIndex:
+    """
+    Memory-maps the file at *path*, which was created by :func:`write_index`,
+    and returns a :class:`URLIndex` for it.
+
+    ``ValueError`` is raised if the file is not a URL index, or if it was
+    written with an unsupported version of the format.
+    """
+    return URLIndex(path)
+
+
+def _build_hash_table(store: URLStore) -> array:
+    # Builds an open addressing table with linear probing. Each slot holds the
+    # position of a URL plus 1, or 0 if it's empty.
+    count = len(store)
+    if count >= 2**31:
+        raise OverflowError('Too many URLs for a hash index')
+
+    size = 8
+    while size < count * 2:
+        size *= 2
+
+    table = array('I', bytes(size * 4))
+    with memoryview(store._data) as data:
+        starts = store._starts
+        for position in range(count):
+            href = data[starts[position] : starts[position + 1]]
+            slot = _probe_hash_table(table, data, starts, href)
+            # Only the first occurrence of each URL is recorded
+            if not table[slot]:
+                table[slot] = position + 1
+            href.release()
+
+    return table
+
+
+def _probe_hash_table(table, data, starts, href) -> int:
+    # Returns the slot that holds href, or the empty slot where it would go.
+    # crc32 is used because Python's hash() varies between processes.
+    mask = len(table) - 1
+    slot = crc32(href) & mask
+    while True:
+        position = table[slot]
+        if (not position) or (data[starts[position - 1] : starts[position]] == href):
+            return slot
+        slot = (slot + 1) & mask
+
+
 def get_version():
     return ffi.string(lib.ada_get_version()).decode()
@@ -0,0 +1,283 @@
+"""
+Vectorized URL parsing for `PyArrow <https://arrow.apache.org/docs/python/>`__
+arrays and `pandas <https://pandas.pydata.org/>`__ objects.
+
+This module requires ``pyarrow``, which can be installed with the ``arrow`` extra:
+
+.. code-block:: sh
+
+    pip install ada_url[arrow]
+
+:func:`parse_array` parses a column of URLs and returns a ``StructArray`` with
+a field for each URL component:
+
+.. code-block:: python
+
+    >>> import pyarrow as pa
+    >>> from ada_url.arrow import parse_array
+    >>> urls = pa.array(['https://example.org/a?b', 'bogus', None])
+    >>> parse_array(urls, attributes=('hostname', 'search')).to_pylist()
+    [{'hostname': 'example.org', 'search': '?b'}, None, None]
+
+Invalid URLs and nulls produce null rows.
+
+If ``pandas`` is installed, importing this module also registers an ``ada``
+accessor for ``Series`` objects:
+
+.. code-block:: python
+
+    >>> import pandas as pd
+    >>> import ada_url.arrow
+    >>> s = pd.Series(['https://example.org/a?b', 'https://example.com/'])
+    >>> s.ada.hostname.tolist()
+    ['example.org', 'example.com']
+    >>> s.ada.parse(attributes=('protocol', 'pathname'))
+      protocol pathname
+    0   https:       /a
+    1   https:        /
+
+The input strings are read directly from the Arrow data buffer, and each output
+column is assembled in a single contiguous buffer.
+"""
+
+from array import array
+from typing import Iterable, List, Union
+
+import pyarrow as pa
+
+from ada_url.ada_adapter import (
+    PARSE_ATTRIBUTES,
+    _SPAN_INDEXES,
+    _get_spans,
+    ffi,
+    lib,
+)
+
+try:
+    import pandas as pd
+except ImportError:  # pragma: no cover
+    pd = None
+
+__all__ = ['parse_array']
+
+_INT32_MAX = 2**31 - 1
+
+_MAX_GETTER_COLUMNS = 2
+
+
+def parse_array(
+    values: Union[pa.Array, pa.ChunkedArray, Iterable[str]],
+    attributes: Iterable[str] = PARSE_ATTRIBUTES,
+) -> Union[pa.StructArray, pa.ChunkedArray]:
+    """
+    Parses each URL in *values* and returns a ``StructArray`` with one field for
+    each of the given *attributes*.
+
+    *values* can be a PyArrow ``string`` or ``large_string`` array, a
+    ``ChunkedArray`` of them, a ``pandas.Series``, or any sequence of strings.
+    ``ChunkedArray`` inputs give ``ChunkedArray`` outputs.
+
+    The ``host_type`` and ``scheme_type`` fields are ``uint8`` columns, and the
+    rest are string columns.
+    """
+    attributes = tuple(attributes)
+    for attr in attributes:
+        if attr not in PARSE_ATTRIBUTES:
+            raise ValueError(f'Unknown attribute: {attr}')
+
+    if not isinstance(values, (pa.Array, pa.ChunkedArray)):
+        values = pa.array(values, from_pandas=True)
+
+    if isinstance(values, pa.ChunkedArray):
+        chunks = [_parse_chunk(chunk, attributes) for chunk in values.chunks]
+        return pa.chunked_array(chunks, type=_get_struct_type(values.type, attributes))
+
+    return _parse_chunk(values, attributes)
+
+
+def _get_struct_type(value_type: pa.DataType, attributes: Iterable[str]):
+    string_type = (
+        pa.large_string() if pa.types.is_large_string(value_type) else pa.string()
+    )
+    fields = []
+    for attr in attributes:
+        if attr in ('host_type', 'scheme_type'):
+            fields.append(pa.field(attr, pa.uint8()))
+        else:
+            fields.append(pa.field(attr, string_type))
+
+    return pa.struct(fields)
+
+
+def _parse_chunk(values: pa.Array, attributes: List[str]) -> pa.StructArray:
+    if pa.types.is_large_string(values.type):
+        offset_format = 'q'
+    elif pa.types.is_string(values.type) or pa.types.is_null(values.type):
+        offset_format = 'i'
+    else:
+        raise TypeError(f'Expected an array of strings, not {values.type}')
+
+    struct_type = _get_struct_type(values.type, attributes)
+    row_count = len(values)
+    input_validity = None
+    if pa.types.is_null(values.type):
+        input_validity = bytes((row_count + 7) // 8)
+        input_offsets = [0] * (row_count + 1)
+        input_data = ffi.NULL
+    else:
+        validity_buffer, offsets_buffer, data_buffer = values.buffers()
+        if values.null_count:
+            input_validity = memoryview(validity_buffer)
+        input_offsets = memoryview(offsets_buffer).cast(offset_format)
+        if (data_buffer is None) or (data_buffer.size == 0):
+            input_data = ffi.NULL
+        else:
+            input_data = ffi.from_buffer(data_buffer)
+
+    span_columns = [
+        (attr, _SPAN_INDEXES[attr], array('q', [0]), bytearray())
+        for attr in attributes
+        if attr in _SPAN_INDEXES
+    ]
+    # Calling the getters is quicker for a few components; slicing them all out
+    # of the href is quicker for several.
+    use_spans = len(span_columns) > _MAX_GETTER_COLUMNS
+    getters = [getattr(lib, f'ada_get_{attr}') for attr, *_ in span_columns]
+    origin_column = (array('q', [0]), bytearray()) if 'origin' in attributes else None
+    host_types = array('B') if 'host_type' in attributes else None
+    scheme_types = array('B') if 'scheme_type' in attributes else None
+    validity = bytearray((row_count + 7) // 8)
+    null_count = 0
+
+    parse = lib.ada_parse
+    is_valid = lib.ada_is_valid
+    free = lib.ada_free
+    get_href = lib.ada_get_href
+    get_components = lib.ada_get_components
+
+    first = values.offset
+    for i in range(row_count):
+        urlobj = None
+        j = first + i
+        if (input_validity is None) or (input_validity[j >> 3] >> (j & 7)) & 1:
+            start = input_offsets[j]
+            urlobj = parse(input_data + start, input_offsets[j + 1] - start)
+            if not is_valid(urlobj):
+                free(urlobj)
+                urlobj = None
+
+        if urlobj is None:
+            null_count += 1
+            for _, _, offsets, _ in span_columns:
+                offsets.append(offsets[-1])
+            if origin_column is not None:
+                origin_column[0].append(origin_column[0][-1])
+            if host_types is not None:
+                host_types.append(0)
+            if scheme_types is not None:
+                scheme_types.append(0)
+            continue
+
+        try:
+            validity[i >> 3] |= 1 << (i & 7)
+
+            if use_spans:
+                href = get_href(urlobj)
+                href_bytes = ffi.unpack(href.data, href.length)
+                spans = _get_spans(href_bytes, get_components(urlobj))
+                for _, span_index, offsets, data in span_columns:
+                    span_start, span_end = spans[span_index]
+                    data += href_bytes[span_start:span_end]
+                    offsets.append(len(data))
+            else:
+                for (_, _, offsets, data), getter in zip(span_columns, getters):
+                    value = getter(urlobj)
+                    data += ffi.buffer(value.data, value.length)
+                    offsets.append(len(data))
+
+            if origin_column is not None:
+                origin = lib.ada_get_origin(urlobj)
+                origin_column[1].extend(ffi.buffer(origin.data, origin.length))
+                origin_column[0].append(len(origin_column[1]))
+                lib.ada_free_owned_string(origin)
+            if host_types is not None:
+                host_types.append(lib.ada_get_host_type(urlobj))
+            if scheme_types is not None:
+                scheme_types.append(lib.ada_get_scheme_type(urlobj))
+        finally:
+            free(urlobj)
+
+    validity_buffer = pa.py_buffer(validity) if null_count else None
+    columns = {}
+    for attr, _, offsets, data in span_columns:
+        columns[attr] = _get_string_array(
+            struct_type.field(attr).type, row_count, validity_buffer, offsets, data
+        )
+    if origin_column is not None:
+        columns['origin'] = _get_string_array(
+            struct_type.field('origin').type, row_count, validity_buffer, *origin_column
+        )
+    for attr, codes in (('host_type', host_types), ('scheme_type', scheme_types)):
+        if codes is not None:
+            columns[attr] = pa.Array.from_buffers(
+                pa.uint8(), row_count, [validity_buffer, pa.py_buffer(codes)]
+            )
+
+    return pa.Array.from_buffers(
+        struct_type,
+        row_count,
+        [validity_buffer],
+        null_count=null_count,
+        children=[columns[attr] for attr in attributes],
+    )
+
+
+def _get_string_array(string_type, row_count, validity_buffer, offsets, data):
+    if pa.types.is_string(string_type):
+        if offsets[-1] > _INT32_MAX:
+            raise OverflowError('Output column is too large for the string type')
+        offsets = array('i', offsets)
+
+    return pa.Array.from_buffers(
+        string_type,
+        row_count,
+        [validity_buffer, pa.py_buffer(offsets), pa.py_buffer(data)],
+    )
+
+
+if pd is not None:
+
+    @pd.api.extensions.register_series_accessor('ada')
+    class AdaSeriesAccessor:
+        """
+        Provides URL parsing for pandas ``Series`` of strings as ``Series.ada``.
+
+        * ``Series.ada.parse(attributes)`` returns a ``DataFrame`` with a column
+          for each of the given *attributes*.
+        * ``Series.ada.<attribute>`` returns a ``Series`` with the given
+          component of each URL.
+
+        Columns are backed by PyArrow arrays, and invalid URLs become nulls.
+        """
+
+        def __init__(self, series):
+            self._series = series
+
+        def __dir__(self) -> List[str]:
+            return super().__dir__() + list(PARSE_ATTRIBUTES)
+
+        def __getattr__(self, attr: str):
+            if attr in PARSE_ATTRIBUTES:
+                return self.parse(attributes=(attr,))[attr]
+
+            raise AttributeError(f'no attribute named {attr}')
+
+        def parse(self, attributes: Iterable[str] = PARSE_ATTRIBUTES):
+            parsed = parse_array(self._series, attributes=attributes)
+            if isinstance(parsed, pa.ChunkedArray):
+                parsed = parsed.combine_chunks()
+
+            table = pa.Table.from_arrays(parsed.flatten(), names=list(attributes))
+            ret = table.to_pandas(types_mapper=pd.ArrowDtype)
+            ret.index = self._series.index
+            return ret
@@ -1,26 +1,455 @@
+"""
+Measures throughput and memory use of ada_url's APIs on a synthetic URL corpus.
+
+.. code-block:: sh
+
+    python benchmark.py --count 1000000
+    python benchmark.py --count 10000000 --apis URL.parse,check_urls --workers 1,2,4
+    python benchmark.py --corpus wpt
+
+The corpus is generated deterministically from --seed, so runs with the same
+arguments measure the same URLs. It's generated in chunks that are excluded
+from the timings, so large counts don't need to fit in memory.
+
+For each API, the report has URLs/sec, the peak RSS, and the memory retained
+per URL object (Python heap and native). Each API and number of workers is run
+in a new process, so the peak RSS is its own. With --workers, the corpus is
+split between threads or processes (--mode) to give a scaling curve.
+
+The URL.setters, URL.update, and replace_url APIs apply the same changes to
+each URL (see SETTER_VALUES), to compare the ways of rewriting URLs. Use
+--corpus-kinds to see how they depend on the URLs' lengths, e.g. with
+--corpus-kinds long_query.
+"""
+
+import gc
+import tracemalloc
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import accumulate
+from multiprocessing import get_context
+from json import dumps, load
 from os.path import dirname, join
-from json import load
-from urllib.parse import urlparse
+from random import Random
 from time import perf_counter
+from urllib.parse import urlsplit
+
+from ada_url import URL, check_urls, normalize_url, parse_url, replace_url
 
-from ada_url import URL
+try:
+    import resource
+except ImportError:
+    resource = None
 
 URL_TEST_DATA_PATH = join(dirname(__file__), 'tests/files/urltestdata.json')
 
-with open(URL_TEST_DATA_PATH, 'rb') as f:
-    test_data = load(f)
-
-test_cases = []
-for item in test_data:
-    if isinstance(item, str) or item.get('failure', False):
-        continue
-    test_cases.append(item['href'])
-
-print('Function', 'msec', 'URLs/msec', sep='\t')
-for func_name, func in (('stdlib urlparse', urlparse), ('ada_url URL', URL)):
-    start_time = perf_counter()
-    for item in test_cases:
-        func(item)
-    duration = perf_counter() - start_time
-    rate = len(test_cases) / duration
-    print(func_name, f'{duration * 1000:0.2f}', f'{rate / 1000:0.2f}', sep='\t')
+CHUNK_SIZE = 100_000
+
+# Hosts are drawn from a pool with a long tail, as in crawled data
+HOST_WORDS = (
+    'example', 'news', 'shop', 'cdn', 'static', 'api', 'blog', 'mail', 'docs',
+    'media', 'images', 'video', 'forum', 'wiki', 'login', 'data', 'search',
+)  # fmt: skip
+IDN_WORDS = ('bücher', 'münchen', 'пример', '例え', 'ελληνικά', 'straße', 'café')
+TLDS = ('com', 'org', 'net', 'de', 'co.uk', 'io', 'jp', 'ru', 'fr', 'com.au')
+PATH_WORDS = (
+    'index.html', 'about', 'products', 'item', 'search', 'static', 'js', 'css',
+    'img', 'v1', 'v2', 'user', 'en', 'de', 'article', '2024', 'download',
+)  # fmt: skip
+QUERY_KEYS = ('q', 'id', 'page', 'sort', 'ref', 'lang', 'utm_source', 'session')
+
+# (kind, weight) for the valid URLs in the corpus
+URL_KINDS = (
+    ('simple', 50),
+    ('query', 12),
+    ('long_query', 4),
+    ('percent', 8),
+    ('idn', 8),
+    ('ipv4', 4),
+    ('ipv6', 2),
+    ('userinfo', 3),
+    ('dots', 5),
+    ('other_scheme', 4),
+)
+
+
+# The components that the setter APIs change, as a URL-rewriting proxy would
+SETTER_VALUES = {
+    'protocol': 'https:',
+    'host': 'proxy.example:8443',
+    'pathname': '/fetch/page',
+    'search': '?via=proxy',
+    'hash': '',
+}
+
+
+def generate_urls(count, seed=0, invalid_fraction=0.05, kinds=None):
+    """
+    Yields *count* URLs, drawn deterministically from a mix of URL kinds
+    (optionally limited to the given *kinds*). About *invalid_fraction* of them
+    can't be parsed.
+    """
+    rng = Random(seed)
+    url_kinds = [item for item in URL_KINDS if (kinds is None) or (item[0] in kinds)]
+    kinds = [kind for kind, _ in url_kinds]
+    kind_weights = list(accumulate(weight for _, weight in url_kinds))
+    hosts = [_random_host(rng) for _ in range(5000)]
+    host_weights = list(accumulate(1 / (rank + 1) for rank in range(len(hosts))))
+
+    for _ in range(count):
+        if rng.random() < invalid_fraction:
+            yield _invalid_url(rng, hosts)
+            continue
+
+        kind = rng.choices(kinds, cum_weights=kind_weights)[0]
+        host = rng.choices(hosts, cum_weights=host_weights)[0]
+        yield _valid_url(rng, kind, host)
+
+
+def _random_host(rng):
+    labels = [rng.choice(HOST_WORDS) + str(rng.randrange(100))]
+    if rng.random() < 0.4:
+        labels.insert(0, rng.choice(('www', 'm', 'en', 'app')))
+    return '.'.join(labels + [rng.choice(TLDS)])
+
+
+def _random_path(rng, segments):
+    return '/' + '/'.join(rng.choice(PATH_WORDS) for _ in range(segments))
+
+
+def _random_query(rng, params):
+    return '&'.join(
+        f'{rng.choice(QUERY_KEYS)}={rng.randrange(10**6)}' for _ in range(params)
+    )
+
+
+def _valid_url(rng, kind, host):
+    path = _random_path(rng, rng.randrange(1, 5))
+    if kind == 'simple':
+        return f'https://{host}{path}'
+    if kind == 'query':
+        return f'https://{host}{path}?{_random_query(rng, rng.randrange(1, 5))}'
+    if kind == 'long_query':
+        query = _random_query(rng, rng.randrange(20, 60))
+        return f'https://{host}{path}?{query}#{rng.choice(PATH_WORDS)}'
+    if kind == 'percent':
+        return f'https://{host}{path}/a b%20c/%E4%BE%8B?q=x y&r=%zz'
+    if kind == 'idn':
+        return f'https://{rng.choice(IDN_WORDS)}.{rng.choice(TLDS)}{path}'
+    if kind == 'ipv4':
+        octets = '.'.join(str(rng.randrange(256)) for _ in range(4))
+        return f'http://{octets}:{rng.randrange(1024, 65536)}{path}'
+    if kind == 'ipv6':
+        groups = ':'.join(f'{rng.randrange(65536):x}' for _ in range(4))
+        return f'http://[2001:db8::{groups}]{path}'
+    if kind == 'userinfo':
+        return f'ftp://user{rng.randrange(100)}:secret@{host}:2121{path}'
+    if kind == 'dots':
+        return f'HTTPS://{host.upper()}{path}/../.{path}/./'
+    return rng.choice(
+        (
+            f'mailto:user{rng.randrange(1000)}@{host}',
+            f'file:///home/user{path}',
+            f'data:text/plain,{rng.randrange(10**6)}',
+            f'git+ssh://{host}{path}.git',
+        )
+    )
+
+
+def _invalid_url(rng, hosts):
+    host = rng.choice(hosts)
+    return rng.choice(
+        (
+            f'{host}/no-scheme',
+            f'https://exa mple.{host}/',
+            f'http://[{host}]/',
+            'https://',
+            f'http://{host}:99999/',
+        )
+    )
+
+
+def get_chunks(corpus, count, seed, invalid_fraction, kinds=None):
+    # Yields lists of URLs for the given corpus
+    if corpus == 'wpt':
+        with open(URL_TEST_DATA_PATH, 'rb') as f:
+            test_data = load(f)
+        hrefs = [
+            item['href']
+            for item in test_data
+            if (not isinstance(item, str)) and (not item.get('failure', False))
+        ]
+        for start in range(0, count, CHUNK_SIZE):
+            size = min(CHUNK_SIZE, count - start)
+            yield [hrefs[i % len(hrefs)] for i in range(start, start + size)]
+        return
+
+    urls = generate_urls(
+        count, seed=seed, invalid_fraction=invalid_fraction, kinds=kinds
+    )
+    for start in range(0, count, CHUNK_SIZE):
+        size = min(CHUNK_SIZE, count - start)
+        yield [next(urls) for _ in range(size)]
+
+
+def _urlsplit_all(urls):
+    for url in urls:
+        try:
+            urlsplit(url)
+        except ValueError:
+            pass
+
+
+def _url_all(urls):
+    parse = URL.parse
+    for url in urls:
+        parse(url)
+
+
+def _parse_url_all(urls):
+    for url in urls:
+        parse_url(url, default=None)
+
+
+def _normalize_url_all(urls):
+    for url in urls:
+        normalize_url(url, default=None)
+
+
+def _url_setters_all(urls):
+    parse = URL.parse
+    for url in urls:
+        urlobj = parse(url)
+        if urlobj is None:
+            continue
+        try:
+            for attr, value in SETTER_VALUES.items():
+                setattr(urlobj, attr, value)
+        except ValueError:
+            pass
+        urlobj.href
+
+
+def _url_update_all(urls):
+    parse = URL.parse
+    for url in urls:
+        urlobj = parse(url)
+        if urlobj is None:
+            continue
+        try:
+            urlobj.update(**SETTER_VALUES)
+        except ValueError:
+            pass
+        urlobj.href
+
+
+def _replace_url_all(urls):
+    for url in urls:
+        replace_url(url, default=None, **SETTER_VALUES)
+
+
+APIS = {
+    'urlsplit': _urlsplit_all,
+    'URL.parse': _url_all,
+    'parse_url': _parse_url_all,
+    'normalize_url': _normalize_url_all,
+    'check_urls': check_urls,
+    'URL.setters': _url_setters_all,
+    'URL.update': _url_update_all,
+    'replace_url': _replace_url_all,
+}
+
+
+def run_shard(api, corpus, count, seed, invalid_fraction, kinds=None):
+    """
+    Processes *count* URLs with *api*, and returns the number of seconds it
+    took and the peak RSS in bytes.
+    """
+    func = APIS[api]
+    elapsed = 0.0
+    for chunk in get_chunks(corpus, count, seed, invalid_fraction, kinds):
+        start_time = perf_counter()
+        func(chunk)
+        elapsed += perf_counter() - start_time
+
+    return elapsed, get_peak_rss()
+
+
+def get_peak_rss():
+    if resource is None:
+        return None
+
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _get_current_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, AttributeError):
+        return None
+
+
+def measure_retained(corpus, count, seed, invalid_fraction, kinds=None):
+    """
+    Returns the Python heap and native bytes retained per URL object, from
+    holding *count* of them at once. Native bytes are the RSS growth that
+    tracemalloc doesn't account for, so they're approximate.
+    """
+    urls = [
+        url
+        for chunk in get_chunks(corpus, count, seed, invalid_fraction, kinds)
+        for url in chunk
+    ]
+    gc.collect()
+    rss_before = _get_current_rss()
+    tracemalloc.start()
+    objs = [URL.parse(url) for url in urls]
+    python_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    rss_after = _get_current_rss()
+
+    valid = sum(obj is not None for obj in objs)
+    if (rss_before is None) or (not valid):
+        return python_bytes / max(valid, 1), None
+
+    native_bytes = max(rss_after - rss_before - python_bytes, 0)
+    return python_bytes / valid, native_bytes / valid
+
+
+def run_benchmark(
+    api, corpus, count, seed, invalid_fraction, workers, mode, kinds=None
+):
+    # Splits the corpus between the workers, each with its own seed
+    shard_size = count // workers
+    shards = [
+        (api, corpus, shard_size, seed + i, invalid_fraction, kinds)
+        for i in range(workers)
+    ]
+    if workers == 1:
+        results = [run_shard(*shards[0])]
+        wall_time = results[0][0]
+    else:
+        executor_class = ThreadPoolExecutor if mode == 'thread' else ProcessPoolExecutor
+        with executor_class(max_workers=workers) as executor:
+            results = list(executor.map(run_shard, *zip(*shards)))
+        # The workers overlap, so the slowest one's processing time is used
+        # rather than the wall time, which includes generating the corpus.
+        wall_time = max(elapsed for elapsed, _ in results)
+
+    peak_rss = max((rss for _, rss in results if rss is not None), default=None)
+    return {
+        'api': api,
+        'corpus': corpus,
+        'count': shard_size * workers,
+        'workers': workers,
+        'mode': mode,
+        'seconds': wall_time,
+        'urls_per_second': (shard_size * workers) / wall_time,
+        'peak_rss_mb': None if peak_rss is None else peak_rss / 2**20,
+    }
+
+
+def main(argv=None):
+    parser = ArgumentParser(description='Benchmark ada_url on a synthetic corpus')
+    parser.add_argument('--count', type=int, default=100_000)
+    parser.add_argument('--corpus', choices=('synthetic', 'wpt'), default='synthetic')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--invalid-fraction', type=float, default=0.05)
+    parser.add_argument(
+        '--corpus-kinds',
+        help='limit the synthetic corpus to these URL kinds, e.g. simple,long_query',
+    )
+    parser.add_argument('--apis', default=','.join(APIS))
+    parser.add_argument('--workers', default='1', help='e.g. 1,2,4,8')
+    parser.add_argument('--mode', choices=('thread', 'process'), default='thread')
+    parser.add_argument(
+        '--retained-sample',
+        type=int,
+        default=100_000,
+        help='number of URL objects to hold when measuring memory per URL',
+    )
+    parser.add_argument('--json', help='append results to this JSON lines file')
+    args = parser.parse_args(argv)
+
+    try:
+        worker_counts = [int(x) for x in args.workers.split(',')]
+    except ValueError:
+        parser.error(f'invalid --workers: {args.workers}')
+    for workers in worker_counts:
+        if workers < 1:
+            parser.error('--workers must be positive')
+        if args.count < workers:
+            parser.error('--count must be at least the number of workers')
+
+    apis = args.apis.split(',')
+    for api in apis:
+        if api not in APIS:
+            parser.error(f'unknown API: {api}')
+
+    kinds = None
+    if args.corpus_kinds:
+        kinds = args.corpus_kinds.split(',')
+        for kind in kinds:
+            if kind not in dict(URL_KINDS):
+                parser.error(f'unknown URL kind: {kind}')
+
+    results = []
+    print('API', 'workers', 'URLs', 'sec', 'URLs/sec', 'peak RSS MB', sep='\t')
+    # ru_maxrss is the peak for the whole process, so each run gets a new one
+    mp_context = get_context('spawn')
+    for api in apis:
+        for workers in worker_counts:
+            with ProcessPoolExecutor(max_workers=1, mp_context=mp_context) as executor:
+                future = executor.submit(
+                    run_benchmark,
+                    api,
+                    args.corpus,
+                    args.count,
+                    args.seed,
+                    args.invalid_fraction,
+                    workers,
+                    args.mode,
+                    kinds,
+                )
+                result = future.result()
+            results.append(result)
+            print(
+                api,
+                workers,
+                result['count'],
+                f'{result["seconds"]:0.2f}',
+                f'{result["urls_per_second"]:0.0f}',
+                f'{result["peak_rss_mb"] or 0:0.1f}',
+                sep='\t',
+            )
+
+    if args.retained_sample:
+        python_bytes, native_bytes = measure_retained(
+            args.corpus,
+            args.retained_sample,
+            args.seed,
+            args.invalid_fraction,
+            kinds,
+        )
+        native = 'n/a' if native_bytes is None else f'{native_bytes:0.0f}'
+        print()
+        print('Retained bytes per URL object', 'Python', 'native', sep='\t')
+        print('', f'{python_bytes:0.0f}', native, sep='\t')
+        results.append(
+            {
+                'api': 'URL',
+                'retained_python_bytes_per_url': python_bytes,
+                'retained_native_bytes_per_url': native_bytes,
+            }
+        )
+
+    if args.json:
+        with open(args.json, 'a') as f:
+            for result in results:
+                f.write(dumps(result) + '\n')
+
+
+if __name__ == '__main__':
+    main()
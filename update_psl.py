@@ -0,0 +1,25 @@
+"""
+update_psl.py
+
+Run this script to pull in the latest version of the Public Suffix List.
+"""
+
+from os.path import dirname, join
+
+from certifi import where
+from urllib3 import PoolManager
+
+
+PSL_URL = 'https://publicsuffix.org/list/public_suffix_list.dat'
+TARGET_PATH = join(dirname(__file__), 'ada_url/public_suffix_list.dat')
+
+
+def main():
+    http_client = PoolManager(cert_reqs='CERT_REQUIRED', ca_certs=where())
+    resp = http_client.request('GET', PSL_URL)
+    with open(TARGET_PATH, 'wb') as f:
+        f.write(resp.data)
+
+
+if __name__ == '__main__':
+    main()